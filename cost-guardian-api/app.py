@@ -1,55 +1,193 @@
-from flask import Flask, request, jsonify, render_template, g
+from flask import Flask, Response, request, jsonify, render_template, g, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import logging, uuid, time, sqlite3, traceback, secrets
-from functools import wraps
-from datetime import datetime, timezone
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+import orjson
+import logging, time, sqlite3, secrets, hashlib, hmac, itertools, os, gzip, queue, random, atexit, re
+from logging.handlers import QueueHandler, QueueListener
+from functools import wraps, lru_cache
+from datetime import date, datetime, timezone
 
-from config import DB_PATH, SERVER_PORT, API_KEY, ENV, DEBUG, ALLOWED_ORIGINS, RATE_LIMIT_RPM, RATE_LIMIT_BURST, RATE_LIMIT_EXEMPT, INGEST_KEY, INGEST_RPM, INGEST_BURST, TRACKING_TOKEN_LENGTH
-from db import migrate, insert_usage, get_tracking_token_by_token, touch_tracking_token_last_seen, check_usage_duplicate, create_tracking_token, list_tracking_tokens, set_tracking_token_active, delete_tracking_token, query_usage, list_models
-from rate_limit import init_limit, init_ingest_limit, check_rate_limit, is_exempt_path
+from config import SERVER_PORT, API_KEY, ENV, DEBUG, ALLOWED_ORIGINS, RATE_LIMIT_RPM, RATE_LIMIT_BURST, RATE_LIMIT_EXEMPT, INGEST_KEY, INGEST_RPM, INGEST_BURST, TRACKING_TOKEN_LENGTH, DATA_CACHE_TTL, TOKEN_CACHE_TTL, REDIS_URL, LOG_SAMPLE_RATE, LOG_SLOW_MS, LOG_FORMAT
+from db import migrate, start_maintenance, usage_params, usage_values, get_tracking_token_by_token, create_tracking_token, list_tracking_tokens, set_tracking_token_active, delete_tracking_token, iter_usage, USAGE_COLUMNS, list_models, clear_usage, get_usage_version, get_tracking_tokens_version, get_metrics_snapshot
+from calc import compute_cost
+from writer import enqueue_usage_many, insert_usage_sync, queue_depth, touch_last_seen, add_commit_hook, stop_writer, QUEUE_MAX_ROWS
+from cache import TTLCache
+from rate_limit import init_limit, init_ingest_limit, init_redis_backend, check_rate_limit, is_exempt_path
 from metrics import increment_rate_limit_hits, increment_ingest_success, increment_ingest_duplicate, increment_ingest_bad_auth, increment_ingest_validation_error, observe_latency, observe_status
 
+# --- JSON serialization ---
+
+# Non-str keys cover dicts keyed by HTTP status code (e.g. metrics http_status)
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes responses with orjson (C) instead of stdlib json."""
+    
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default, option=_ORJSON_OPTIONS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=_ORJSON_OPTIONS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Security: Set maximum content length to 1MB to prevent abuse
-app.config['MAX_CONTENT_LENGTH'] = 1 * 1024 * 1024  # 1MB
+MAX_BODY_BYTES = 1 * 1024 * 1024  # 1MB
+
+# SQLite INTEGER range; larger Python ints can't be bound and would fail the writer batch
+SQLITE_INT_MIN = -2**63
+SQLITE_INT_MAX = 2**63 - 1
+app.config['MAX_CONTENT_LENGTH'] = MAX_BODY_BYTES
 
 # CORS setup - exclude /ingest (server-to-server only)
+# Preflight responses are cached for a day so writes don't pay an extra OPTIONS round trip
+CORS_MAX_AGE = 86400
+CORS_METHODS = ["GET","POST","DELETE","OPTIONS"]
+CORS_ALLOW_HEADERS = ["Content-Type","X-API-Key","X-Correlation-ID"]
 if ALLOWED_ORIGINS:
     CORS(app, resources={
              r"/(?!ingest).*": {  # Exclude /ingest from CORS
                  "origins": ALLOWED_ORIGINS,
                  "supports_credentials": False,
-                 "methods": ["GET","POST","DELETE","OPTIONS"],
-                 "allow_headers": ["Content-Type","X-API-Key"]
+                 "methods": CORS_METHODS,
+                 "allow_headers": CORS_ALLOW_HEADERS,
+                 "max_age": CORS_MAX_AGE  # let browsers cache preflights
              }
          })
 else:
     # In development, still exclude /ingest from CORS
-    CORS(app, resources={r"/(?!ingest).*": {}})
+    CORS(app, resources={r"/(?!ingest).*": {"max_age": CORS_MAX_AGE}})
     logging.warning("ALLOWED_ORIGINS not set—CORS is wide open for non-ingest endpoints (dev mode)")
 
+class CORSPreflightMiddleware:
+    """Answer CORS preflights from precomputed headers before Flask dispatch.
+    
+    Mirrors the Flask-CORS configuration above: /ingest paths and (when
+    ALLOWED_ORIGINS is set) unknown origins fall through to Flask, which
+    answers them without CORS headers as before.
+    """
+    
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.origins = frozenset(ALLOWED_ORIGINS)
+        if ALLOWED_ORIGINS:
+            methods = CORS_METHODS
+            self.allowed_headers = frozenset(h.lower() for h in CORS_ALLOW_HEADERS)
+        else:
+            # Dev mode: any method, echo whatever headers were requested
+            methods = ["GET","HEAD","POST","PUT","PATCH","DELETE","OPTIONS"]
+            self.allowed_headers = None
+        self.static_headers = [
+            ('Access-Control-Allow-Methods', ", ".join(sorted(methods))),
+            ('Access-Control-Max-Age', str(CORS_MAX_AGE)),
+            ('Vary', 'Origin'),
+            ('Content-Length', '0'),
+        ]
+    
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') != 'OPTIONS':
+            return self.wsgi_app(environ, start_response)
+        origin = environ.get('HTTP_ORIGIN')
+        if (not origin or 'HTTP_ACCESS_CONTROL_REQUEST_METHOD' not in environ
+                or environ.get('PATH_INFO', '').startswith('/ingest')
+                or (self.origins and origin not in self.origins)):
+            return self.wsgi_app(environ, start_response)
+        
+        headers = [('Access-Control-Allow-Origin', origin)]
+        requested = environ.get('HTTP_ACCESS_CONTROL_REQUEST_HEADERS')
+        if requested:
+            names = [h.strip() for h in requested.split(',') if h.strip()]
+            if self.allowed_headers is not None:
+                names = [h for h in names if h.lower() in self.allowed_headers]
+            if names:
+                headers.append(('Access-Control-Allow-Headers', ", ".join(names)))
+        start_response('200 OK', headers + self.static_headers)
+        return [b'']
+
+app.wsgi_app = CORSPreflightMiddleware(app.wsgi_app)
+
 # --- Startup initialization (runs for both dev and Gunicorn) ---
 
+class _JSONLogFormatter(logging.Formatter):
+    """Format records as one orjson-encoded object per line."""
+    
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry).decode()
+
+def _install_queue_logging():
+    """Move root log handler I/O onto a background QueueListener thread.
+    
+    Request threads only enqueue records; writing to stderr/files (and the
+    handler locks that go with it) happens on the listener thread.
+    """
+    root = logging.getLogger()
+    handlers = [h for h in root.handlers if not isinstance(h, QueueHandler)]
+    if not handlers or len(handlers) != len(root.handlers):
+        return  # nothing to wrap, or already installed
+    if LOG_FORMAT == "json":
+        formatter = _JSONLogFormatter()
+        for handler in handlers:
+            handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    # Flush pending records on shutdown. atexit runs callbacks LIFO and writer.py
+    # registered stop_writer at import, so stop it here first (it's idempotent)
+    # or its final flush would log into a stopped listener.
+    def _shutdown():
+        stop_writer()
+        listener.stop()
+    atexit.register(_shutdown)
+
 def init_startup():
     """Initialize application startup logic for both Flask dev server and Gunicorn."""
+    _install_queue_logging()
+    
     # Production validation - fail fast if misconfigured
     if ENV == "production" and not API_KEY:
         import sys
         logging.error("API_KEY must be set in production environment")
         raise SystemExit(1)
     
+    if not 16 <= TRACKING_TOKEN_LENGTH <= 40:
+        logging.error("Invalid TRACKING_TOKEN_LENGTH %s (must be 16-40)", TRACKING_TOKEN_LENGTH)
+        raise SystemExit(1)
+    
     # Database migration (idempotent, safe for multiple workers)
     migrate()
     
+    # Periodic incremental vacuum + ANALYZE (per-process daemon timer)
+    start_maintenance()
+    
     # Rate limiting initialization (per-process, worker-safe)
     init_limit(RATE_LIMIT_RPM, RATE_LIMIT_BURST, RATE_LIMIT_EXEMPT)
     init_ingest_limit(INGEST_RPM, INGEST_BURST)
+    if REDIS_URL and not init_redis_backend(REDIS_URL):
+        logging.warning("Falling back to per-worker rate limit buckets")
+    
+    if not API_KEY:
+        logging.warning("API_KEY not configured - admin endpoints accessible without auth")
     
     # Safe startup logging (no secrets)
     logging.info("Dashboard auth requirement: %s", "ENFORCED" if ENV == "production" else "DISABLED (dev)")
     logging.info("Rate limiting initialized | Admin RPM=%d | BURST=%d | EXEMPT=%s", 
-                 RATE_LIMIT_RPM, RATE_LIMIT_BURST, ",".join(RATE_LIMIT_EXEMPT))
+                 RATE_LIMIT_RPM, RATE_LIMIT_BURST, RATE_LIMIT_EXEMPT)
     logging.info("Ingest rate limiting initialized | RPM=%d | BURST=%d", 
                  INGEST_RPM, INGEST_BURST)
     
@@ -59,46 +197,107 @@ init_startup()
 
 # --- Auth middleware ---
 
+# Encoded once so each check is a single constant-time compare
+_API_KEY_BYTES = API_KEY.encode()
+_INGEST_KEY_BYTES = INGEST_KEY.encode()
+
+def _key_matches(provided: str, expected: bytes) -> bool:
+    """Constant-time comparison of a request header against a configured key."""
+    return bool(provided) and hmac.compare_digest(provided.encode(), expected)
+
 def require_api_key(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # Skip auth if no API key is configured
+        # Skip auth if no API key is configured (warned once at startup)
         if not API_KEY:
-            logging.warning("API_KEY not configured - endpoint accessible without auth")
             return f(*args, **kwargs)
         
-        auth_header = request.headers.get('X-API-Key')
-        if not auth_header or auth_header != API_KEY:
+        # Reuse the header already read by the rate limiter when available
+        auth_header = g.api_key if 'api_key' in g else request.headers.get('X-API-Key')
+        if not _key_matches(auth_header, _API_KEY_BYTES):
             logging.warning("[%s] Unauthorized access attempt to %s", g.get('req_id', '-'), request.path)
             return json_error(401, "Unauthorized")
         
         return f(*args, **kwargs)
     return decorated_function
 
+def safe_route(f=None, *, on_error=None):
+    """Turn unexpected exceptions in a route into a logged JSON 500.
+    
+    HTTP errors (aborts, bad JSON bodies, oversized requests) are re-raised so
+    the HTTPException handler answers them with their own status. Only routes
+    that need a JSON 500 in development too, or a failure hook, use this; the
+    rest rely on handle_exception.
+    
+    Args:
+        on_error: Optional callback run before returning the 500 (e.g. a metrics counter)
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            except HTTPException:
+                raise
+            except Exception:
+                logging.exception("[%s] Error occurred in %s %s route",
+                                  g.get('req_id', '-'), request.method, request.path)
+                if on_error is not None:
+                    on_error()
+                return json_error(500, "Internal server error")
+        return wrapper
+    return decorator(f) if f is not None else decorator
+
 # --- Request tracing & JSON error middleware ---
 
 
+# Request IDs: random per-process prefix + counter, cheaper than a UUID per request.
+# The prefix is random rather than pid-based so restarted workers don't reuse IDs.
+_req_counter = itertools.count()
+_req_prefix = os.urandom(2).hex()
+
+def _reset_req_ids():
+    global _req_counter, _req_prefix
+    _req_counter = itertools.count()
+    _req_prefix = os.urandom(2).hex()
+
+# Forked workers (e.g. Gunicorn --preload) must not share the parent's prefix
+os.register_at_fork(after_in_child=_reset_req_ids)
+
+# Inbound correlation IDs are only trusted if short and log-safe
+_CORRELATION_ID_RE = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+
+# One hook instead of separate timer and rate-limit hooks saves a dispatch per request
 @app.before_request
-def _start_timer():
-    # Short request ID for log correlation
-    g.req_id = uuid.uuid4().hex[:8]
+def _before_request():
+    # Short request ID for log correlation; reuse the caller's X-Correlation-ID when valid
+    correlation_id = request.headers.get("X-Correlation-ID")
+    if correlation_id and _CORRELATION_ID_RE.fullmatch(correlation_id):
+        g.req_id = correlation_id
+    else:
+        g.req_id = f"{_req_prefix}{next(_req_counter) & 0xFFFFFF:06x}"
     # High-resolution start time
-    g.t0 = time.perf_counter()
+    g.t0_ns = time.perf_counter_ns()
+    
+    # Skip rate limiting for exempt paths and methods; _log_request reuses the flag
+    exempt = g.exempt = is_exempt_path(request.path, request.method)
+    if exempt:
+        return None
+    return _check_rate_limit()
 
-@app.before_request
 def _check_rate_limit():
-    # Skip rate limiting for exempt paths and methods
-    if is_exempt_path(request.path, request.method):
-        return None
+    # Read the header once; @require_api_key picks it up from g
+    api_key = g.api_key = request.headers.get("X-API-Key")
     
-    # Auth should precede throttling - let @require_api_key handle 401 first
-    if API_KEY and not request.headers.get("X-API-Key"):
+    # Auth should precede throttling - wrong keys go straight to @require_api_key's
+    # 401 without charging (or creating) a bucket
+    if API_KEY and not _key_matches(api_key, _API_KEY_BYTES):
         return None  # let @require_api_key handle 401
     
     # Determine the rate limiting key
     if API_KEY:
         # Auth enabled - use API key from header
-        limiter_key = request.headers.get("X-API-Key", "anonymous")
+        limiter_key = api_key
     else:
         # Dev/no-auth mode - use IP address
         limiter_key = request.remote_addr or "unknown"
@@ -124,56 +323,63 @@ def _check_rate_limit():
     # Store remaining tokens for response headers
     g.rate_limit_remaining = remaining
 
+# Paths with latency/status metrics
+_OBSERVED_PATHS = frozenset(('/data', '/ingest'))
+
 @app.after_request
 def _log_request(resp):
-    # Duration in ms, even if g.t0 is missing for any reason
-    dt_ms = int((time.perf_counter() - g.get('t0', time.perf_counter())) * 1000)
-    logging.info("[%s] %s %s -> %s (%sms)",
-                 g.get('req_id', '-'), request.method, request.path, resp.status_code, dt_ms)
+    path = request.path
+    # Duration in whole ms (0 if g.t0_ns is missing for any reason)
+    now_ns = time.perf_counter_ns()
+    dt_ms = (now_ns - g.get('t0_ns', now_ns)) // 1_000_000
+    # Tail sampling: errors and slow requests are always logged, the rest at LOG_SAMPLE_RATE
+    if resp.status_code >= 400 or dt_ms >= LOG_SLOW_MS or LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE:
+        logging.info("[%s] %s %s -> %s (%sms)",
+                     g.get('req_id', '-'), request.method, path, resp.status_code, dt_ms)
 
     # Record metrics for specific endpoints
-    if request.path in ['/data', '/ingest']:
-        observe_latency(request.path, dt_ms)
-        observe_status(request.path, resp.status_code)
+    if path in _OBSERVED_PATHS:
+        observe_latency(path, dt_ms)
+        observe_status(path, resp.status_code)
 
     # Add rate limit headers for all non-exempt requests (including 429s)
-    if not is_exempt_path(request.path, request.method):
+    if not g.get('exempt', False):
         resp.headers["X-RateLimit-Limit"] = str(RATE_LIMIT_RPM)
         # Use 0 for blocked requests, actual remaining for others
         remaining = getattr(g, 'rate_limit_remaining', 0)
         resp.headers["X-RateLimit-Remaining"] = str(int(remaining))
 
-    # Avoid caching JSON responses
-    if resp.content_type and "application/json" in resp.content_type:
+    # Avoid caching JSON responses unless the handler chose a revalidation policy
+    content_type = resp.content_type
+    if content_type and "application/json" in content_type and "Cache-Control" not in resp.headers:
         resp.headers["Cache-Control"] = "no-store"
     return resp
 
-def json_error(status_code: int, message: str):
-    payload = {
-        "status": "error",
-        "message": message,
-        "requestId": g.get("req_id", None),
-    }
-    return jsonify(payload), status_code
-
-# Consistent JSON errors for common cases
-@app.errorhandler(400)
-def _400(e): return json_error(400, "Bad request")
-
-@app.errorhandler(401)
-def _401(e): return json_error(401, "Unauthorized")
-
-@app.errorhandler(403)
-def _403(e): return json_error(403, "Forbidden")
+@lru_cache(maxsize=256)
+def _error_body_prefix(message: str) -> bytes:
+    """Serialized '{"status":"error","message":...,"requestId":' for a message."""
+    return b'{"status":"error","message":' + orjson.dumps(message) + b',"requestId":'
 
-@app.errorhandler(404)
-def _404(e): return json_error(404, "Not found")
+def json_error(status_code: int, message: str):
+    # Only the request ID is encoded per call; the rest of the body is cached per message
+    body = _error_body_prefix(message) + orjson.dumps(g.get("req_id", None)) + b'}'
+    return Response(body, status=status_code, mimetype='application/json'), status_code
 
-@app.errorhandler(405)
-def _405(e): return json_error(405, "Method not allowed")
+# Consistent JSON errors for all HTTP errors; known codes keep their established messages
+_HTTP_ERROR_MESSAGES = {
+    400: "Bad request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not found",
+    405: "Method not allowed",
+    413: "Request body too large",
+    500: "Internal server error",
+}
 
-@app.errorhandler(500)
-def _500(e): return json_error(500, "Internal server error")
+@app.errorhandler(HTTPException)
+def _http_error(e):
+    code = e.code or 500
+    return json_error(code, _HTTP_ERROR_MESSAGES.get(code) or e.name)
 
 # Global exception handler for consistent production error responses
 @app.errorhandler(Exception)
@@ -190,12 +396,33 @@ def handle_exception(e):
         logging.exception("[%s] Unhandled exception", g.get('req_id', '-'))
         return json_error(500, "Internal server error")
 
+# Per-query /data ETags, cleared on local writes and expiring after DATA_CACHE_TTL
+_data_etags = TTLCache(DATA_CACHE_TTL, maxsize=256)
+# Cleared once queued rows are committed, not when they're queued - a /data poll
+# in between would otherwise cache the pre-write ETag again
+add_commit_hook(_data_etags.clear)
+
+# Serialized /models body and its ETag. New models show up within
+# MODELS_CACHE_TTL; /reset and token deletes clear it since they remove rows.
+MODELS_CACHE_TTL = 30
+_models_cache = TTLCache(MODELS_CACHE_TTL, maxsize=1)
+
+# Tracking-token rows looked up by /ingest, keyed by token string. Only hits
+# are cached; toggling or deleting a token clears it in this worker, other
+# workers pick the change up within TOKEN_CACHE_TTL (config, 0 = no caching).
+_token_cache = TTLCache(TOKEN_CACHE_TTL, maxsize=4096)
+
+# /data pagination bounds (rows per response)
+DATA_DEFAULT_LIMIT = 5000
+DATA_MAX_LIMIT = 10000
+# Rows encoded together and sent in each streamed /data write
+DATA_STREAM_CHUNK_ROWS = 256
+
 # Date normalization helpers for filtering
 
-def _to_iso_utc_end_of_day(date_only: str) -> str:
-    """Convert YYYY-MM-DD to end-of-day UTC ISO string."""
-    dt = datetime.fromisoformat(date_only).replace(tzinfo=timezone.utc)
-    return dt.replace(hour=23, minute=59, second=59).isoformat().replace("+00:00", "Z")
+# YYYY-MM-DD with a day that exists in every month; these skip datetime parsing.
+# Days 29-31 still go through fromisoformat so invalid dates are rejected.
+_DATE_ONLY_RE = re.compile(r"(?!0000)[0-9]{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|1[0-9]|2[0-8])")
 
 def _normalize_time_param(v: str, is_end: bool = False) -> str:
     """Normalize time parameter to ISO UTC string.
@@ -209,14 +436,12 @@ def _normalize_time_param(v: str, is_end: bool = False) -> str:
     """
     if not v:
         return None
+    if _DATE_ONLY_RE.fullmatch(v):
+        return v + ("T23:59:59Z" if is_end else "T00:00:00Z")
     try:
-        # Check if it's a date-only format (YYYY-MM-DD)
+        # Other date-only values (YYYY-MM-DD): validate, then append the time directly
         if len(v) == 10 and v[4] == '-' and v[7] == '-':
-            if is_end:
-                return _to_iso_utc_end_of_day(v)
-            else:
-                dt = datetime.fromisoformat(v).replace(tzinfo=timezone.utc)
-                return dt.isoformat().replace("+00:00", "Z")
+            return date.fromisoformat(v).isoformat() + ("T23:59:59Z" if is_end else "T00:00:00Z")
         
         # Handle full ISO format (with or without Z/offset)
         iso_str = v.replace("Z", "+00:00") if v.endswith("Z") else v
@@ -225,403 +450,606 @@ def _normalize_time_param(v: str, is_end: bool = False) -> str:
     except Exception:
         return None
 
-@app.route('/ping')
-def ping():
-    return jsonify({"message": "pong"})
+# --- Health checks (answered in WSGI middleware, before Flask dispatch) ---
+
+# Static /ping body, serialized once
+_PONG = b'{"message":"pong"}'
+_HEALTH_CHECK_PATHS = frozenset(('/ping', '/health'))
 
-@app.route('/health')
-def health():
-    return jsonify({"status": "healthy", "timestamp": time.time()})
+class HealthCheckMiddleware:
+    """Answer GET/HEAD /ping and /health straight from the WSGI environ.
+    
+    Health checkers poll these constantly; skipping Flask means no Request
+    object, no before/after hooks and no routing for them. Other methods
+    fall through to Flask, which answers them with the usual JSON 404.
+    """
+    
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+    
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO')
+        method = environ.get('REQUEST_METHOD')
+        if path not in _HEALTH_CHECK_PATHS or method not in ('GET', 'HEAD'):
+            return self.wsgi_app(environ, start_response)
+        
+        if path == '/ping':
+            body = _PONG
+        else:
+            body = orjson.dumps({"status": "healthy", "timestamp": time.time()})
+        start_response('200 OK', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Cache-Control', 'no-store'),
+        ])
+        return [b''] if method == 'HEAD' else [body]
+
+app.wsgi_app = HealthCheckMiddleware(app.wsgi_app)
 
 @app.route('/metrics')
 @require_api_key  
+@safe_route
 def get_system_metrics():
     """Get comprehensive system metrics and health status."""
-    try:
-        from datetime import datetime, timezone
-        from rate_limit import get_config
-        from metrics import get_metrics
-        
-        # Get rate limiting configuration
-        rate_limit_config = get_config()
-        
-        # Get metrics counters
-        counters = get_metrics()
-        
-        # Database queries
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # Usage rows count
-            cursor.execute("SELECT COUNT(*) as count FROM usage_log")
-            usage_rows = cursor.fetchone()["count"]
-            
-            # Active tracking tokens count
-            cursor.execute("SELECT COUNT(*) as count FROM ingest_tokens WHERE active=1")
-            active_tokens = cursor.fetchone()["count"]
-            
-            # Last usage timestamp
-            cursor.execute("SELECT MAX(timestamp) as last_timestamp FROM usage_log")
-            last_usage_raw = cursor.fetchone()["last_timestamp"]
-            
-            # Last ingest token seen timestamp
-            cursor.execute("SELECT MAX(last_seen_at) as last_seen FROM ingest_tokens WHERE last_seen_at IS NOT NULL")
-            last_token_seen_raw = cursor.fetchone()["last_seen"]
-            
-            # Token activity health indicators (1m/5m/1h)
-            cursor.execute("""
-                SELECT 
-                    COUNT(CASE WHEN datetime(last_seen_at) > datetime('now', '-1 minute') THEN 1 END) as seen_1m,
-                    COUNT(CASE WHEN datetime(last_seen_at) > datetime('now', '-5 minute') THEN 1 END) as seen_5m,
-                    COUNT(CASE WHEN datetime(last_seen_at) > datetime('now', '-1 hour') THEN 1 END) as seen_1h
-                FROM ingest_tokens 
-                WHERE last_seen_at IS NOT NULL
-            """)
-            token_activity = cursor.fetchone()
-        
-        # Format timestamps
-        last_usage_at = last_usage_raw if last_usage_raw else None
-        last_token_seen_at = last_token_seen_raw if last_token_seen_raw else None
-        
-        # Build response
-        metrics_data = {
-            "version": "1",
-            "env": ENV,
-            "debug": DEBUG,
-            "rate_limit": rate_limit_config,
-            "ingest": {
-                "rpm": INGEST_RPM,
-                "burst": INGEST_BURST,
-                "auth_enabled": bool(INGEST_KEY),
-                "tracking_token_length": TRACKING_TOKEN_LENGTH
-            },
-            "counters": counters,
-            "db": {
-                "usage_rows": usage_rows,
-                "active_tokens": active_tokens,
-                "last_usage_at": last_usage_at,
-                "last_token_seen_at": last_token_seen_at
-            },
-            "ingestion_health": {
-                "tokens_seen_1m": token_activity["seen_1m"],
-                "tokens_seen_5m": token_activity["seen_5m"], 
-                "tokens_seen_1h": token_activity["seen_1h"]
-            }
+    from datetime import datetime, timezone
+    from rate_limit import get_config
+    from metrics import get_metrics
+    
+    # Get rate limiting configuration
+    rate_limit_config = get_config()
+    
+    # Get metrics counters
+    counters = get_metrics()
+    
+    # Database stats in a single round trip
+    stats = get_metrics_snapshot()
+    
+    # Format timestamps
+    last_usage_at = stats["last_usage"] if stats["last_usage"] else None
+    last_token_seen_at = stats["last_token_seen"] if stats["last_token_seen"] else None
+    
+    # Build response
+    metrics_data = {
+        "version": "1",
+        "env": ENV,
+        "debug": DEBUG,
+        "rate_limit": rate_limit_config,
+        "ingest": {
+            "rpm": INGEST_RPM,
+            "burst": INGEST_BURST,
+            "auth_enabled": bool(INGEST_KEY),
+            "tracking_token_length": TRACKING_TOKEN_LENGTH
+        },
+        "counters": counters,
+        "writer": {
+            "queue_depth": queue_depth(),
+            "queue_max": QUEUE_MAX_ROWS
+        },
+        "db": {
+            "usage_rows": stats["usage_rows"],
+            "active_tokens": stats["active_tokens"],
+            "last_usage_at": last_usage_at,
+            "last_token_seen_at": last_token_seen_at
+        },
+        "ingestion_health": {
+            "tokens_seen_1m": stats["seen_1m"],
+            "tokens_seen_5m": stats["seen_5m"], 
+            "tokens_seen_1h": stats["seen_1h"]
         }
-        
-        return jsonify(metrics_data)
-        
-    except Exception:
-        logging.exception("[%s] Error occurred in /metrics route", g.get('req_id', '-'))
-        if DEBUG:
-            return jsonify({"error": traceback.format_exc()}), 500
-        else:
-            return json_error(500, "Internal server error")
+    }
+    
+    return jsonify(metrics_data)
 
 
 @app.route('/data', methods=['GET'])
 @require_api_key
+@safe_route
 def get_data():
     """Get usage data with optional filtering by date range, model, and tracking token."""
-    try:
-        # Extract query parameters
-        start_param = request.args.get('start')
-        end_param = request.args.get('end')
-        model_param = request.args.get('model')
-        ingest_token_id_param = request.args.get('ingest_token_id')
-        
-        # Normalize and validate date parameters
-        start_normalized = _normalize_time_param(start_param, is_end=False) if start_param else None
-        end_normalized = _normalize_time_param(end_param, is_end=True) if end_param else None
-        
-        # Validate date parameters
-        if start_param and not start_normalized:
-            return json_error(400, f"Invalid start date format: {start_param}. Use YYYY-MM-DD or ISO-8601.")
-        
-        if end_param and not end_normalized:
-            return json_error(400, f"Invalid end date format: {end_param}. Use YYYY-MM-DD or ISO-8601.")
-        
-        # Validate date range
-        if start_normalized and end_normalized:
-            start_dt = datetime.fromisoformat(start_normalized.replace("Z", "+00:00"))
-            end_dt = datetime.fromisoformat(end_normalized.replace("Z", "+00:00"))
-            if start_dt > end_dt:
-                return json_error(400, "Start date cannot be after end date.")
-        
-        # Validate ingest_token_id parameter
-        ingest_token_id = None
-        if ingest_token_id_param:
-            try:
-                ingest_token_id = int(ingest_token_id_param)
-                if ingest_token_id <= 0:
-                    return json_error(400, "ingest_token_id must be a positive integer.")
-            except (ValueError, TypeError):
-                return json_error(400, "ingest_token_id must be a valid integer.")
-        
-        # Query with filters
-        logging.info("Querying usage data with filters: start=%s, end=%s, model=%s, ingest_token_id=%s", 
-                    start_normalized, end_normalized, model_param, ingest_token_id)
-        
-        rows = query_usage(
-            start=start_normalized,
-            end=end_normalized, 
-            model=model_param,
-            ingest_token_id=ingest_token_id
-        )
-        
-        logging.info("Fetched %d rows from DB with filters.", len(rows))
-        return jsonify({"data": rows})
-        
-    except Exception:
-        logging.exception("[%s] Error occurred in /data route", g.get('req_id', '-'))
-        if DEBUG:
-            return jsonify({"error": traceback.format_exc()}), 500
-        else:
-            return json_error(500, "Internal server error")
+    # Extract query parameters
+    start_param = request.args.get('start')
+    end_param = request.args.get('end')
+    model_param = request.args.get('model')
+    ingest_token_id_param = request.args.get('ingest_token_id')
+    limit_param = request.args.get('limit')
+    format_param = request.args.get('format', 'rows')
+    offset_param = request.args.get('offset')
+    
+    # Normalize and validate date parameters
+    start_normalized = _normalize_time_param(start_param, is_end=False) if start_param else None
+    end_normalized = _normalize_time_param(end_param, is_end=True) if end_param else None
+    
+    # Validate date parameters
+    if start_param and not start_normalized:
+        return json_error(400, f"Invalid start date format: {start_param}. Use YYYY-MM-DD or ISO-8601.")
+    
+    if end_param and not end_normalized:
+        return json_error(400, f"Invalid end date format: {end_param}. Use YYYY-MM-DD or ISO-8601.")
+    
+    # Validate date range
+    if start_normalized and end_normalized:
+        start_dt = datetime.fromisoformat(start_normalized.replace("Z", "+00:00"))
+        end_dt = datetime.fromisoformat(end_normalized.replace("Z", "+00:00"))
+        if start_dt > end_dt:
+            return json_error(400, "Start date cannot be after end date.")
+    
+    # Validate ingest_token_id parameter
+    ingest_token_id = None
+    if ingest_token_id_param:
+        try:
+            ingest_token_id = int(ingest_token_id_param)
+            if ingest_token_id <= 0:
+                return json_error(400, "ingest_token_id must be a positive integer.")
+        except (ValueError, TypeError):
+            return json_error(400, "ingest_token_id must be a valid integer.")
+    
+    if format_param not in ('rows', 'columns'):
+        return json_error(400, "format must be 'rows' or 'columns'.")
+    columnar = format_param == 'columns'
+    
+    # Validate pagination parameters (bounded so a single call can't scan the whole table)
+    limit = DATA_DEFAULT_LIMIT
+    if limit_param:
+        try:
+            limit = int(limit_param)
+            if limit <= 0:
+                return json_error(400, "limit must be a positive integer.")
+        except (ValueError, TypeError):
+            return json_error(400, "limit must be a valid integer.")
+        limit = min(limit, DATA_MAX_LIMIT)
+    
+    offset = 0
+    if offset_param:
+        try:
+            offset = int(offset_param)
+            if offset < 0:
+                return json_error(400, "offset must be a non-negative integer.")
+        except (ValueError, TypeError):
+            return json_error(400, "offset must be a valid integer.")
+    
+    # Conditional GET - dashboards poll /data, so answer 304 while nothing changed.
+    # The ETag is trusted for DATA_CACHE_TTL seconds, then re-derived from a
+    # cheap version query instead of re-reading and re-serializing rows.
+    cache_key = request.query_string
+    etag = _data_etags.get(cache_key)
+    if etag is None:
+        version = get_usage_version()
+        etag = hashlib.blake2b(version.encode() + b"|" + cache_key, digest_size=8).hexdigest()
+        _data_etags.set(cache_key, etag)
+    
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+    
+    # Query with filters (debug only - the access log line already covers each request)
+    logging.debug("[%s] Querying usage data with filters: start=%s, end=%s, model=%s, ingest_token_id=%s, limit=%s, offset=%s", 
+                  g.get('req_id', '-'), start_normalized, end_normalized, model_param, ingest_token_id, limit, offset)
+    
+    rows = iter_usage(
+        start=start_normalized,
+        end=end_normalized, 
+        model=model_param,
+        ingest_token_id=ingest_token_id,
+        limit=limit,
+        offset=offset,
+        as_tuples=columnar
+    )
+    
+    # Run the query now so DB errors still map to a 500 before streaming starts
+    first_row = next(rows, None)
+    
+    # Stream row by row instead of materializing the result. format=columns sends
+    # {"columns":[...],"rows":[[...],...]} built from raw tuples, without repeating
+    # key names per row; the default keeps the {"data":[{...},...]} shape.
+    head = b'{"columns":' + orjson.dumps(USAGE_COLUMNS) + b',"rows":[' if columnar else b'{"data":['
+    
+    def generate():
+        try:
+            yield head
+            if first_row is None:
+                yield b']}'
+                return
+            # Encode DATA_STREAM_CHUNK_ROWS rows per orjson call and write; slicing
+            # off the list brackets leaves comma-joined rows to splice into the array
+            batch = [first_row]
+            sep = b''
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= DATA_STREAM_CHUNK_ROWS:
+                    yield sep + orjson.dumps(batch)[1:-1]
+                    sep = b','
+                    batch = []
+            if batch:
+                yield sep + orjson.dumps(batch)[1:-1]
+            yield b']}'
+        finally:
+            rows.close()
+    
+    resp = Response(stream_with_context(generate()), mimetype='application/json')
+    resp.set_etag(etag)
+    # Let the browser keep the body but revalidate every poll with If-None-Match
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
 @app.route('/models', methods=['GET'])
 @require_api_key
 def get_models():
     """Get all distinct model names from the usage data."""
-    try:
+    cached = _models_cache.get('models')
+    if cached is None:
         models = list_models()
         logging.info("Returning %d distinct models", len(models))
-        return jsonify({"models": models})
-    except Exception:
-        logging.exception("[%s] Error occurred in /models route", g.get('req_id', '-'))
-        if DEBUG:
-            return jsonify({"error": traceback.format_exc()}), 500
-        else:
-            return json_error(500, "Internal server error")
+        body = orjson.dumps({"models": models})
+        cached = (body, hashlib.blake2b(body, digest_size=8).hexdigest())
+        _models_cache.set('models', cached)
+    body, etag = cached
+    
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = f"private, max-age={MODELS_CACHE_TTL}"
+    return resp
 
 @app.route('/log', methods=['POST'])
 @require_api_key
 def log_data():
     """DEPRECATED: Legacy endpoint for logging usage data. Use POST /ingest with tracking tokens instead."""
+    # Log deprecation warning
+    logging.warning("[%s] DEPRECATED: /log endpoint used - consider migrating to POST /ingest with tracking tokens", 
+                   g.get('req_id', '-'))
+    
+    # Reject declared oversized bodies before reading them
+    if request.content_length is not None and request.content_length > MAX_BODY_BYTES:
+        return json_error(413, "Request body too large")
+    
+    # Parse the raw body with orjson; the bytes aren't needed after this
     try:
-        # Log deprecation warning
-        logging.warning("[%s] DEPRECATED: /log endpoint used - consider migrating to POST /ingest with tracking tokens", 
-                       g.get('req_id', '-'))
-        
-        data = request.json
-        if not data:
-            return json_error(400, "JSON body required")
-        
-        # Use the insert_usage function with source='legacy' for backward compatibility
-        usage_row = {
-            "timestamp": data.get('timestamp'),
-            "model": data.get('model'), 
-            "promptTokens": data.get('promptTokens', 0),
-            "completionTokens": data.get('completionTokens', 0),
-            "totalTokens": data.get('totalTokens', 0),
-            "estimatedCostUSD": data.get('estimatedCostUSD', 0.0)
-        }
-        
-        insert_usage(usage_row, source='legacy')  # Mark as legacy endpoint usage
-        
-        return jsonify({
-            "message": "Data logged successfully",
-            "warning": "DEPRECATED: This endpoint is deprecated. Please migrate to POST /ingest with tracking tokens."
-        })
-    except Exception:
-        logging.exception("[%s] Error occurred in /log route", g.get('req_id', '-'))
-        if DEBUG:
-            return jsonify({"error": traceback.format_exc()}), 500
-        else:
-            return json_error(500, "Internal server error")
+        raw = request.get_data(cache=False)
+    except RequestEntityTooLarge:
+        # Chunked bodies without Content-Length are cut off at MAX_CONTENT_LENGTH
+        return json_error(413, "Request body too large")
+    try:
+        data = orjson.loads(raw) if raw else None
+    except orjson.JSONDecodeError:
+        return json_error(400, "Invalid JSON body")
+    if not data:
+        return json_error(400, "JSON body required")
+    
+    # Accept a single event or a client-side batch (list) of events
+    events = data if isinstance(data, list) else [data]
+    if not all(isinstance(event, dict) for event in events):
+        return json_error(400, "JSON body must be an object or a list of objects")
+    
+    # Coerce and type-check before queueing so a malformed event gets a 400 here;
+    # a row SQLite still rejects is isolated by the writer and doesn't drop others.
+    # source='legacy' marks rows from this endpoint for backward compatibility.
+    rows = []
+    for i, event in enumerate(events):
+        try:
+            params = usage_params(event, source='legacy')
+        except (ValueError, TypeError):
+            return json_error(400, f"Event {i}: token counts and estimatedCostUSD must be numeric")
+        timestamp, model = params[0], params[1]
+        if not (timestamp is None or type(timestamp) is str) or not (model is None or type(model) is str):
+            return json_error(400, f"Event {i}: timestamp and model must be strings")
+        if not all(SQLITE_INT_MIN <= n <= SQLITE_INT_MAX for n in params[2:5]):
+            return json_error(400, f"Event {i}: token counts must fit in a 64-bit integer")
+        rows.append(params)
+    
+    # The background writer commits queued rows together in one transaction
+    try:
+        enqueue_usage_many(rows)
+    except queue.Full:
+        # Backpressure: the writer is behind, so ask the client to retry instead of buffering more
+        logging.warning("[%s] Usage writer queue full (%d rows pending), rejecting %d rows",
+                        g.get('req_id', '-'), queue_depth(), len(rows))
+        resp = json_error(503, "Write queue is full, retry shortly")
+        resp[0].headers["Retry-After"] = "1"
+        return resp
+    
+    return jsonify({
+        "message": "Data accepted for logging",
+        "accepted": len(rows),
+        "warning": "DEPRECATED: This endpoint is deprecated. Please migrate to POST /ingest with tracking tokens."
+    }), 202
 
 @app.route('/reset', methods=['DELETE'])
 @require_api_key
 def reset_db():
-    try:
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM usage_log")
-        conn.commit()
-        conn.close()
-        return jsonify({"message": "Database reset successfully"})
-    except Exception:
-        logging.exception("[%s] Error occurred in /reset route", g.get('req_id', '-'))
-        if DEBUG:
-            return jsonify({"error": traceback.format_exc()}), 500
-        else:
-            return json_error(500, "Internal server error")
+    clear_usage()
+    _data_etags.clear()
+    _models_cache.clear()
+    return jsonify({"message": "Database reset successfully"})
+
 
+# (epoch second, ISO string) for the current second, shared by every /ingest
+# in that second. Replaced as a whole tuple, so threads never see a torn pair.
+_now_iso = (0, "")
+
+def _utc_now_iso() -> str:
+    """Current UTC time as an ISO-8601 string with seconds precision."""
+    global _now_iso
+    sec = int(time.time())
+    cached = _now_iso
+    if cached[0] != sec:
+        cached = _now_iso = (sec, datetime.fromtimestamp(sec, timezone.utc).isoformat(timespec='seconds'))
+    return cached[1]
+
+# camelCase payload keys accepted by /ingest and their snake_case names
+_INGEST_FIELD_MAP = {
+    'promptTokens': 'prompt_tokens',
+    'completionTokens': 'completion_tokens',
+    'totalTokens': 'total_tokens',
+    'costUsd': 'cost_usd'
+}
+
+def _resolve_tracking_token(tracking_token: str):
+    """Look up an active tracking token, going through _token_cache.
+    
+    Returns:
+        Tuple of (token data, None) or (None, 404/403 error response)
+    """
+    token_data = _token_cache.get(tracking_token)
+    if token_data is None:
+        token_data = get_tracking_token_by_token(tracking_token)
+        if token_data and TOKEN_CACHE_TTL > 0:
+            _token_cache.set(tracking_token, token_data)
+    if not token_data:
+        increment_ingest_validation_error()
+        return None, json_error(404, "Unknown tracking token")
+    
+    if not token_data['active']:
+        increment_ingest_validation_error()
+        return None, json_error(403, "Tracking token is inactive")
+    return token_data, None
+
+def _ingest_rate_limited(tracking_token: str):
+    """Take a token from the per-tracking-token bucket.
+    
+    Returns:
+        The 429 error response if the bucket is empty, otherwise None
+    """
+    allowed, retry_after, remaining = check_rate_limit(f"ingest:{tracking_token}")
+    if allowed:
+        return None
+    
+    increment_rate_limit_hits()
+    logging.warning("[%s] Rate limit exceeded for tracking token %s", 
+                   g.get('req_id', '-'), mask_tracking_token(tracking_token))
+    resp = json_error(429, "Rate limit exceeded")
+    resp[0].headers["Retry-After"] = str(retry_after)
+    return resp
 
 @app.route('/ingest', methods=['POST'])
+@safe_route(on_error=increment_ingest_validation_error)
 def ingest_usage():
     """Server-to-server endpoint for ingesting OpenAI usage data with tracking token attribution."""
+    # 1. Auth FIRST - check X-Ingest-Key before any other processing
+    ingest_key = request.headers.get('X-Ingest-Key')
+    if not INGEST_KEY:
+        logging.warning("[%s] INGEST_KEY not configured - /ingest endpoint accessible without auth", g.get('req_id', '-'))
+        increment_ingest_bad_auth()
+        return json_error(500, "Ingest authentication not configured")
+    
+    if not _key_matches(ingest_key, _INGEST_KEY_BYTES):
+        logging.warning("[%s] Invalid or missing X-Ingest-Key for /ingest", g.get('req_id', '-'))
+        increment_ingest_bad_auth()
+        return json_error(401, "Invalid or missing X-Ingest-Key")
+    
+    # Optional X-Tracking-Token header lets the per-token bucket be consulted
+    # before the body is read, so throttled senders never cost a JSON parse.
+    # The token is resolved first so only real, active tokens get a bucket.
+    header_token = request.headers.get('X-Tracking-Token', '').strip()
+    token_data = None
+    if header_token:
+        token_data, error = _resolve_tracking_token(header_token)
+        if error:
+            return error
+        limited = _ingest_rate_limited(header_token)
+        if limited:
+            return limited
+    
+    # 2. Validate JSON payload
+    if not request.is_json:
+        increment_ingest_validation_error()
+        return json_error(400, "Content-Type must be application/json")
+    
+    # Reject declared oversized bodies before reading them
+    if request.content_length is not None and request.content_length > MAX_BODY_BYTES:
+        increment_ingest_validation_error()
+        return json_error(413, "Request body too large")
+    
+    # Parse the raw body with orjson directly; get_json() would also keep the bytes cached
     try:
-        # 1. Auth FIRST - check X-Ingest-Key before any other processing
-        ingest_key = request.headers.get('X-Ingest-Key')
-        if not INGEST_KEY:
-            logging.warning("[%s] INGEST_KEY not configured - /ingest endpoint accessible without auth", g.get('req_id', '-'))
-            increment_ingest_bad_auth()
-            return json_error(500, "Ingest authentication not configured")
-        
-        if not ingest_key or ingest_key != INGEST_KEY:
-            logging.warning("[%s] Invalid or missing X-Ingest-Key for /ingest", g.get('req_id', '-'))
-            increment_ingest_bad_auth()
-            return json_error(401, "Invalid or missing X-Ingest-Key")
-        
-        # 2. Validate JSON payload
-        if not request.is_json:
-            increment_ingest_validation_error()
-            return json_error(400, "Content-Type must be application/json")
-        
-        data = request.get_json()
-        if not data:
-            increment_ingest_validation_error()
-            return json_error(400, "JSON body required")
-        
-        # 3. Extract and validate tracking token
-        tracking_token = data.get('tracking_token', '').strip()
-        if not tracking_token:
-            increment_ingest_validation_error()
-            return json_error(400, "tracking_token is required")
-        
-        # Resolve tracking token -> token data
-        token_data = get_tracking_token_by_token(tracking_token)
-        if not token_data:
-            increment_ingest_validation_error()
-            return json_error(404, "Unknown tracking token")
-        
-        if not token_data['active']:
-            increment_ingest_validation_error()
-            return json_error(403, "Tracking token is inactive")
+        raw = request.get_data(cache=False)
+    except RequestEntityTooLarge:
+        increment_ingest_validation_error()
+        return json_error(413, "Request body too large")
+    try:
+        data = orjson.loads(raw) if raw else None
+    except orjson.JSONDecodeError:
+        increment_ingest_validation_error()
+        return json_error(400, "Invalid JSON body")
+    if not data:
+        increment_ingest_validation_error()
+        return json_error(400, "JSON body required")
+    if not isinstance(data, dict):
+        increment_ingest_validation_error()
+        return json_error(400, "JSON body must be an object")
+    
+    # 3. Extract and validate tracking token
+    tracking_token = data.get('tracking_token', '')
+    if not isinstance(tracking_token, str):
+        increment_ingest_validation_error()
+        return json_error(400, "tracking_token must be a string")
+    tracking_token = tracking_token.strip() or header_token
+    if not tracking_token:
+        increment_ingest_validation_error()
+        return json_error(400, "tracking_token is required")
+    if header_token and tracking_token != header_token:
+        increment_ingest_validation_error()
+        return json_error(400, "tracking_token does not match X-Tracking-Token")
+    
+    # Resolve tracking token -> token data and rate limit with per-token buckets
+    # (both already done if the header was sent)
+    if token_data is None:
+        token_data, error = _resolve_tracking_token(tracking_token)
+        if error:
+            return error
         
         # 4. Rate limiting with per-token buckets
-        limiter_key = f"ingest:{tracking_token}"
-        allowed, retry_after, remaining = check_rate_limit(limiter_key)
-        
-        if not allowed:
-            increment_rate_limit_hits()
-            logging.warning("[%s] Rate limit exceeded for tracking token %s", 
-                           g.get('req_id', '-'), mask_tracking_token(tracking_token))
-            resp = json_error(429, "Rate limit exceeded")
-            resp[0].headers["Retry-After"] = str(retry_after)
-            return resp
-        
-        # 5. Payload normalization and validation
-        # Normalize camelCase to snake_case
-        normalized_data = {}
-        field_mapping = {
-            'promptTokens': 'prompt_tokens',
-            'completionTokens': 'completion_tokens', 
-            'totalTokens': 'total_tokens',
-            'costUsd': 'cost_usd'
-        }
-        
-        for key, value in data.items():
-            if key in field_mapping:
-                normalized_data[field_mapping[key]] = value
-            else:
-                normalized_data[key] = value
-        
-        # Extract and validate required fields
-        event_id = normalized_data.get('event_id')
-        provider = normalized_data.get('provider', 'openai')
-        model = normalized_data.get('model', '').strip()
-        prompt_tokens = normalized_data.get('prompt_tokens', 0)
-        completion_tokens = normalized_data.get('completion_tokens', 0) 
-        total_tokens = normalized_data.get('total_tokens')
-        cost_usd = normalized_data.get('cost_usd', 0.0)
-        meta = normalized_data.get('meta', {})
-        
-        # Validation
-        if not model:
-            increment_ingest_validation_error()
-            return json_error(400, "model is required")
-        
-        try:
-            prompt_tokens = int(prompt_tokens)
-            completion_tokens = int(completion_tokens) 
-            if prompt_tokens < 0 or completion_tokens < 0:
-                raise ValueError("Token counts cannot be negative")
-        except (ValueError, TypeError):
+        limited = _ingest_rate_limited(tracking_token)
+        if limited:
+            return limited
+    
+    # 5. Payload normalization and validation
+    # Normalize camelCase to snake_case
+    normalized_data = {_INGEST_FIELD_MAP.get(k, k): v for k, v in data.items()}
+    
+    # Extract and validate required fields
+    event_id = normalized_data.get('event_id')
+    provider = normalized_data.get('provider', 'openai')
+    model = normalized_data.get('model', '')
+    prompt_tokens = normalized_data.get('prompt_tokens', 0)
+    completion_tokens = normalized_data.get('completion_tokens', 0) 
+    total_tokens = normalized_data.get('total_tokens')
+    cost_usd = normalized_data.get('cost_usd', 0.0)
+    meta = normalized_data.get('meta', {})
+    
+    # Validation - types are checked here because the insert no longer coerces them
+    if not isinstance(model, str):
+        increment_ingest_validation_error()
+        return json_error(400, "model must be a string")
+    model = model.strip()
+    if not model:
+        increment_ingest_validation_error()
+        return json_error(400, "model is required")
+    
+    if event_id is not None and (type(event_id) not in (str, int) or
+                                 (type(event_id) is int and not SQLITE_INT_MIN <= event_id <= SQLITE_INT_MAX)):
+        increment_ingest_validation_error()
+        return json_error(400, "event_id must be a string or a 64-bit integer")
+    
+    try:
+        prompt_tokens = int(prompt_tokens)
+        completion_tokens = int(completion_tokens) 
+        if prompt_tokens < 0 or completion_tokens < 0:
+            raise ValueError("Token counts cannot be negative")
+        if prompt_tokens > SQLITE_INT_MAX or completion_tokens > SQLITE_INT_MAX:
+            raise ValueError("Token counts must fit in a 64-bit integer")
+    except (ValueError, TypeError, OverflowError):
+        increment_ingest_validation_error()
+        return json_error(400, "prompt_tokens and completion_tokens must be non-negative integers")
+    
+    # Compute total_tokens if missing
+    if total_tokens is None:
+        total_tokens = prompt_tokens + completion_tokens
+        if total_tokens > SQLITE_INT_MAX:
             increment_ingest_validation_error()
-            return json_error(400, "prompt_tokens and completion_tokens must be non-negative integers")
-        
-        # Compute total_tokens if missing
-        if total_tokens is None:
-            total_tokens = prompt_tokens + completion_tokens
-        else:
-            try:
-                total_tokens = int(total_tokens)
-                if total_tokens < 0:
-                    raise ValueError("Total tokens cannot be negative")
-            except (ValueError, TypeError):
-                increment_ingest_validation_error()
-                return json_error(400, "total_tokens must be a non-negative integer")
-        
-        # Validate cost_usd
+            return json_error(400, "total_tokens must fit in a 64-bit integer")
+    else:
         try:
-            cost_usd = float(cost_usd)
-        except (ValueError, TypeError):
+            total_tokens = int(total_tokens)
+            if total_tokens < 0 or total_tokens > SQLITE_INT_MAX:
+                raise ValueError("Total tokens must be a non-negative 64-bit integer")
+        except (ValueError, TypeError, OverflowError):
             increment_ingest_validation_error()
-            return json_error(400, "cost_usd must be a number")
-        
-        # Server-side cost calculation when cost not provided
-        if cost_usd == 0.0 and (prompt_tokens > 0 or completion_tokens > 0):
-            from calc import compute_cost
-            usage_for_calc = {
-                'prompt_tokens': prompt_tokens,
-                'completion_tokens': completion_tokens
-            }
-            cost_usd = compute_cost(usage_for_calc)
-        
-        # Handle timestamp - use server time if missing
-        timestamp = normalized_data.get('timestamp')
-        if not timestamp:
-            timestamp = datetime.now(timezone.utc).isoformat(timespec='seconds')
-        
-        # 6. Check for idempotency if event_id provided
-        if event_id:
-            if check_usage_duplicate(token_data['id'], event_id):
-                increment_ingest_duplicate()
-                return jsonify({"duplicate": True}), 200
-        
-        # 7. Insert usage data
-        usage_row = {
-            "timestamp": timestamp,
-            "model": model,
-            "promptTokens": prompt_tokens,
-            "completionTokens": completion_tokens,
-            "totalTokens": total_tokens,
-            "estimatedCostUSD": cost_usd
+            return json_error(400, "total_tokens must be a non-negative integer")
+    
+    # Validate cost_usd
+    try:
+        cost_usd = float(cost_usd)
+    except (ValueError, TypeError):
+        increment_ingest_validation_error()
+        return json_error(400, "cost_usd must be a number")
+    
+    # Server-side cost calculation when cost not provided
+    if cost_usd == 0.0 and (prompt_tokens > 0 or completion_tokens > 0):
+        usage_for_calc = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens
         }
-        
-        row_id = insert_usage(usage_row, 
-                             ingest_token_id=token_data['id'], 
-                             source='ingest', 
-                             event_id=event_id)
-        
-        # 8. Update last_seen_at for the tracking token
-        touch_tracking_token_last_seen(token_data['id'], timestamp)
-        
-        # 9. Success metrics and response
-        increment_ingest_success()
-        logging.info("[%s] Successfully ingested usage for token %s: %s tokens, $%s", 
-                    g.get('req_id', '-'), mask_tracking_token(tracking_token), 
-                    total_tokens, cost_usd)
-        
-        return jsonify({"ok": True, "id": row_id}), 201
-        
-    except Exception:
-        logging.exception("[%s] Error occurred in /ingest route", g.get('req_id', '-'))
+        cost_usd = compute_cost(usage_for_calc)
+    
+    # Handle timestamp - use server time if missing
+    timestamp = normalized_data.get('timestamp')
+    if not timestamp:
+        timestamp = _utc_now_iso()
+    elif not isinstance(timestamp, str):
         increment_ingest_validation_error()
-        if DEBUG:
-            return jsonify({"error": traceback.format_exc()}), 500
-        else:
-            return json_error(500, "Internal server error")
+        return json_error(400, "timestamp must be a string")
+    
+    # 6./7. Insert usage data; a repeated event_id for this token is skipped by
+    # the INSERT itself (ON CONFLICT DO NOTHING), so there's no check-then-insert race.
+    # Committed by the writer thread, sharing a transaction with concurrent ingests;
+    # /data ETags are dropped by its commit hook before this returns.
+    try:
+        row_id = insert_usage_sync(usage_values(timestamp, model, prompt_tokens, completion_tokens,
+                                                total_tokens, cost_usd,
+                                                ingest_token_id=token_data['id'],
+                                                source='ingest',
+                                                event_id=event_id))
+    except TimeoutError:
+        # The row is still queued and may yet commit, so don't report a hard failure
+        logging.error("[%s] Usage writer did not commit /ingest row in time (%d rows pending)",
+                      g.get('req_id', '-'), queue_depth())
+        resp = json_error(503, "Write timed out; the event may already have been accepted, "
+                               "retry with the same event_id")
+        resp[0].headers["Retry-After"] = "1"
+        return resp
+    except sqlite3.IntegrityError:
+        # The token was deleted (usage_log.ingest_token_id FK) after this worker cached it
+        _token_cache.pop(tracking_token)
+        increment_ingest_validation_error()
+        logging.warning("[%s] Tracking token %s was deleted during ingest",
+                        g.get('req_id', '-'), mask_tracking_token(tracking_token))
+        return json_error(404, "Unknown tracking token")
+    if row_id is None:
+        increment_ingest_duplicate()
+        return jsonify({"duplicate": True}), 200
+    
+    # 8. Update last_seen_at for the tracking token (server time, so the stored
+    # strings share one format and sort chronologically for /metrics). Coalesced
+    # per token and written in the background within writer.TOUCH_FLUSH_SECS.
+    touch_last_seen(token_data['id'], _utc_now_iso())
+    
+    # 9. Success metrics and response
+    increment_ingest_success()
+    # Per-event detail is debug-only; the sampled access log already records the request
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("[%s] Successfully ingested usage for token %s: %s tokens, $%s",
+                      g.get('req_id', '-'), mask_tracking_token(tracking_token),
+                      total_tokens, cost_usd)
+    
+    return jsonify({"ok": True, "id": row_id}), 201
 
+@lru_cache(maxsize=2048)
 def mask_tracking_token(token: str) -> str:
-    """Create a masked version of a tracking token showing first 4 and last 4 characters."""
+    """Create a masked version of a tracking token showing first 4 and last 4 characters.
+
+    The mask_* helpers are memoized: the same few tokens and keys repeat on
+    every /ingest log line and 429, and the secrets are already in memory.
+    """
     if len(token) <= 8:
         return 'tok_••••'
     return f"tok_{token[:4]}…{token[-4:]}"
 
+# Sliced instead of multiplied so masking doesn't build a new run of dots per call
+_MASK_DOTS = "•" * 256
+
+@lru_cache(maxsize=2048)
+def mask_api_key(key: str) -> str:
+    """Create a masked version of an API key showing only the last 4 characters."""
+    n = len(key)
+    if n <= 4:
+        return '••••'
+    return _MASK_DOTS[:n - 4] + key[-4:]
+
+@lru_cache(maxsize=2048)
 def mask_ingest_key(key: str) -> str:
     """Create a masked version of an ingest key for logging."""
     if len(key) <= 8:
@@ -634,113 +1062,122 @@ def mask_ingest_key(key: str) -> str:
 @require_api_key
 def get_tracking_tokens():
     """List all tracking tokens with metadata and usage counts."""
-    try:
-        tokens = list_tracking_tokens()
-        
-        # Mask the tokens for security
-        for token in tokens:
-            token['token_masked'] = mask_tracking_token(token['token'])
-            # Keep the full token for copy functionality in the UI
-            # token['token'] remains unmasked for admin UI copy buttons
-        
-        return jsonify({"tokens": tokens})
-    except Exception:
-        logging.exception("[%s] Error occurred in GET /ingest/tokens route", g.get('req_id', '-'))
-        if DEBUG:
-            return jsonify({"error": traceback.format_exc()}), 500
-        else:
-            return json_error(500, "Internal server error")
+    # Conditional GET - skip the usage-count aggregation while nothing changed
+    etag = hashlib.blake2b(get_tracking_tokens_version().encode(), digest_size=8).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+    
+    tokens = list_tracking_tokens()
+    
+    # Mask the tokens for security
+    for token in tokens:
+        token['token_masked'] = mask_tracking_token(token['token'])
+        # Keep the full token for copy functionality in the UI
+        # token['token'] remains unmasked for admin UI copy buttons
+    
+    resp = jsonify({"tokens": tokens})
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
 @app.route('/ingest/tokens', methods=['POST'])
 @require_api_key
 def create_tracking_token_endpoint():
     """Create a new tracking token."""
+    data = request.json
+    if not data:
+        return json_error(400, "JSON body required")
+    
+    label = data.get('label', '').strip()
+    
+    # Validation
+    if not label or len(label) > 64:
+        return json_error(400, "Label must be 1-64 characters")
+    
+    # Generate a unique token (TRACKING_TOKEN_LENGTH is validated at startup)
+    token = secrets.token_urlsafe(TRACKING_TOKEN_LENGTH)
+    
+    # Store in database
     try:
-        data = request.json
-        if not data:
-            return json_error(400, "JSON body required")
-        
-        label = data.get('label', '').strip()
-        
-        # Validation
-        if not label or len(label) > 64:
-            return json_error(400, "Label must be 1-64 characters")
-        
-        # Check tracking token length bounds
-        if TRACKING_TOKEN_LENGTH < 16 or TRACKING_TOKEN_LENGTH > 40:
-            logging.error("[%s] Invalid TRACKING_TOKEN_LENGTH %s (must be 16-40)", 
-                         g.get('req_id', '-'), TRACKING_TOKEN_LENGTH)
-            return json_error(500, "Invalid tracking token length configuration")
-        
-        # Generate a unique token
-        token = secrets.token_urlsafe(TRACKING_TOKEN_LENGTH)
-        
-        # Store in database
-        try:
-            result = create_tracking_token(label, token)
-        except sqlite3.IntegrityError as e:
-            if "UNIQUE constraint failed: ingest_tokens.label" in str(e):
-                return json_error(400, f"Label '{label}' already exists")
-            elif "UNIQUE constraint failed: ingest_tokens.token" in str(e):
-                # Extremely unlikely but handle token collision
-                return json_error(500, "Token generation collision, please retry")
-            raise
-        
-        logging.info("[%s] Created new tracking token with ID %s and label '%s'", 
-                    g.get('req_id', '-'), result['id'], label)
-        return jsonify(result), 201
-        
-    except Exception:
-        logging.exception("[%s] Error occurred in POST /ingest/tokens route", g.get('req_id', '-'))
-        if DEBUG:
-            return jsonify({"error": traceback.format_exc()}), 500
-        else:
-            return json_error(500, "Internal server error")
+        result = create_tracking_token(label, token)
+    except sqlite3.IntegrityError as e:
+        if "UNIQUE constraint failed: ingest_tokens.label" in str(e):
+            return json_error(400, f"Label '{label}' already exists")
+        elif "UNIQUE constraint failed: ingest_tokens.token" in str(e):
+            # Extremely unlikely but handle token collision
+            return json_error(500, "Token generation collision, please retry")
+        raise
+    
+    logging.info("[%s] Created new tracking token with ID %s and label '%s'", 
+                g.get('req_id', '-'), result['id'], label)
+    return jsonify(result), 201
 
 @app.route('/ingest/tokens/<int:token_id>/active', methods=['PATCH'])
 @require_api_key
 def toggle_tracking_token_active(token_id):
     """Toggle the active status of a tracking token."""
-    try:
-        data = request.json
-        if not data or 'active' not in data:
-            return json_error(400, "JSON body with 'active' field required")
-        
-        active = bool(data['active'])
-        set_tracking_token_active(token_id, active)
-        
-        logging.info("[%s] Set tracking token %s active status to %s", 
-                    g.get('req_id', '-'), token_id, active)
-        return jsonify({"ok": True})
-        
-    except Exception:
-        logging.exception("[%s] Error occurred in PATCH /ingest/tokens/%s/active route", 
-                         g.get('req_id', '-'), token_id)
-        if DEBUG:
-            return jsonify({"error": traceback.format_exc()}), 500
-        else:
-            return json_error(500, "Internal server error")
+    data = request.json
+    if not data or 'active' not in data:
+        return json_error(400, "JSON body with 'active' field required")
+    
+    active = bool(data['active'])
+    set_tracking_token_active(token_id, active)
+    _token_cache.clear()
+    
+    logging.info("[%s] Set tracking token %s active status to %s", 
+                g.get('req_id', '-'), token_id, active)
+    return jsonify({"ok": True})
 
 @app.route('/ingest/tokens/<int:token_id>', methods=['DELETE'])
 @require_api_key
 def remove_tracking_token(token_id):
     """Delete a tracking token."""
-    try:
-        delete_tracking_token(token_id)
-        logging.info("[%s] Deleted tracking token %s", g.get('req_id', '-'), token_id)
-        return jsonify({"ok": True})
-        
-    except Exception:
-        logging.exception("[%s] Error occurred in DELETE /ingest/tokens/%s route", 
-                         g.get('req_id', '-'), token_id)
-        if DEBUG:
-            return jsonify({"error": traceback.format_exc()}), 500
-        else:
-            return json_error(500, "Internal server error")
+    delete_tracking_token(token_id)
+    _token_cache.clear()
+    _data_etags.clear()
+    _models_cache.clear()
+    logging.info("[%s] Deleted tracking token %s", g.get('req_id', '-'), token_id)
+    return jsonify({"ok": True})
+
+# Rendered dashboard HTML and its ETag; the template only depends on ENV
+_dashboard_cache = None
+
+def _render_dashboard() -> tuple:
+    """Render dashboard.html once per process and return (html_bytes, gzip_bytes, etag)."""
+    global _dashboard_cache
+    # Re-render on every hit when Jinja auto-reload is on (debug) so template edits show up
+    if _dashboard_cache is None or app.jinja_env.auto_reload:
+        html = render_template('dashboard.html', require_signin=(ENV == "production")).encode()
+        # Compress once up front; mtime=0 keeps the bytes stable across workers
+        html_gz = gzip.compress(html, compresslevel=9, mtime=0)
+        _dashboard_cache = (html, html_gz, hashlib.blake2b(html, digest_size=8).hexdigest())
+    return _dashboard_cache
 
 @app.route('/dashboard')
 def dashboard():
-    return render_template('dashboard.html', require_signin=(ENV == "production"))
+    html, html_gz, etag = _render_dashboard()
+    use_gzip = 'gzip' in request.accept_encodings
+    if use_gzip:
+        # Each encoding is a distinct representation and needs its own ETag
+        etag = f"{etag}-gz"
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    elif use_gzip:
+        resp = Response(html_gz, mimetype='text/html')
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(html, mimetype='text/html')
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "public, max-age=60"
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+# Render (and gzip) the dashboard at import so no request pays for it
+with app.app_context():
+    _render_dashboard()
 
 
 if __name__ == '__main__':
@@ -752,7 +1189,9 @@ if __name__ == '__main__':
     logging.info("Starting Cost Guardian API | ENV=%s | DEBUG=%s | ALLOWED_ORIGINS=%d origins | PORT=%d", 
                  ENV, DEBUG, origins_count, SERVER_PORT)
     if ALLOWED_ORIGINS:
-        logging.info("Allowed origins: %s", ", ".join(ALLOWED_ORIGINS))
+        logging.info("Allowed origins: %s", ALLOWED_ORIGINS)
+    if not DEBUG:
+        logging.warning("Running the Flask development server in production - use 'gunicorn wsgi:application' instead")
     
-    # Start Flask development server
-    app.run(host="0.0.0.0", debug=DEBUG, port=SERVER_PORT)
\ No newline at end of file
+    # Start Flask development server (threaded so slow SQLite calls don't serialize requests)
+    app.run(host="0.0.0.0", debug=DEBUG, port=SERVER_PORT, threaded=True)
\ No newline at end of file
@@ -0,0 +1,56 @@
+# cache.py
+# Small in-process TTL cache for hot read paths (per worker process)
+
+import threading
+import time
+from typing import Any, Hashable
+
+class TTLCache:
+    """Thread-safe dict cache whose entries expire a fixed number of seconds after being set.
+    
+    State is per process: with several Gunicorn workers, writes handled by another
+    worker are only observed once the entry expires, so keep TTLs short.
+    """
+    
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}  # {key: (expires_at, value)}
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default if missing or expired."""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        if entry[0] <= time.monotonic():
+            with self._lock:
+                # Only drop it if it wasn't refreshed meanwhile
+                if self._data.get(key) is entry:
+                    del self._data[key]
+            return default
+        return entry[1]
+    
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store value for key, evicting expired then oldest entries when full."""
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._data and len(self._data) >= self.maxsize:
+                for k in [k for k, (exp, _) in self._data.items() if exp <= now]:
+                    del self._data[k]
+                while len(self._data) >= self.maxsize:
+                    del self._data[next(iter(self._data))]
+            self._data[key] = (now + self.ttl, value)
+    
+    def pop(self, key: Hashable) -> None:
+        """Remove a single entry if present."""
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self) -> int:
+        return len(self._data)
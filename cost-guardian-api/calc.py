@@ -1,8 +1,9 @@
+# Example rates (adjust as needed)
+# gpt-4o-mini: ~$0.00015 per 1k input, $0.0006 per 1k output
+INPUT_RATE_PER_TOKEN = 0.00015 / 1000.0
+OUTPUT_RATE_PER_TOKEN = 0.0006 / 1000.0
+
 def compute_cost(usage: dict) -> float:
-    # Example rates (adjust as needed)
-    # gpt-4o-mini: ~$0.00015 per 1k input, $0.0006 per 1k output
-    inp_rate = 0.00015 / 1000.0
-    out_rate = 0.0006 / 1000.0
     pt = usage.get("prompt_tokens", 0) or 0
     ct = usage.get("completion_tokens", 0) or 0
-    return round(pt * inp_rate + ct * out_rate, 8)
\ No newline at end of file
+    return round(pt * INPUT_RATE_PER_TOKEN + ct * OUTPUT_RATE_PER_TOKEN, 8)
\ No newline at end of file
@@ -19,11 +19,26 @@ RATE_LIMIT_RPM = int(os.getenv("RATE_LIMIT_RPM", "60"))
 RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", os.getenv("RATE_LIMIT_RPM", "60")))
 RATE_LIMIT_EXEMPT = [path.strip() for path in os.getenv("RATE_LIMIT_EXEMPT", "/ping,/health,/dashboard").split(",") if path.strip()]
 
+# Shared rate limit backend - when set, token buckets live in Redis and are shared by all workers
+REDIS_URL = os.getenv("REDIS_URL", "")
+
 # Ingestion config
 INGEST_KEY = os.getenv("INGEST_KEY", "")
 INGEST_RPM = int(os.getenv("INGEST_RPM", str(RATE_LIMIT_RPM)))
 INGEST_BURST = int(os.getenv("INGEST_BURST", str(RATE_LIMIT_BURST)))
 
+# Response cache config - seconds a /data ETag is trusted without re-checking the DB
+DATA_CACHE_TTL = float(os.getenv("DATA_CACHE_TTL", "3"))
+# Seconds /ingest trusts a cached tracking-token lookup (per worker); bounds how long
+# other workers keep accepting a deactivated token. 0 disables the cache.
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "5"))
+
+# Request logging - fraction of successful fast requests logged; errors and slow requests always are
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_SLOW_MS = int(os.getenv("LOG_SLOW_MS", "200"))
+# "text" (default) or "json" - one JSON object per log line for log shippers
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
 # Tracking token config
 TRACKING_TOKEN_LENGTH = int(os.getenv("TRACKING_TOKEN_LENGTH", "22"))
 
@@ -45,6 +60,12 @@ DATA_DIR = os.getenv(
 DB_FILENAME = os.getenv("DB_FILENAME", "usage_log.sqlite")
 DB_PATH = os.getenv("DB_PATH", os.path.join(DATA_DIR, DB_FILENAME))
 
+# Maximum number of pooled (read-only) SQLite connections per process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+
+# Seconds between background SQLite maintenance runs (incremental vacuum + ANALYZE); 0 disables
+DB_MAINTENANCE_INTERVAL = float(os.getenv("DB_MAINTENANCE_INTERVAL", "3600"))
+
 # Log resolved database path on startup
 logging.basicConfig(level=logging.INFO)
 logging.info("Database path resolved to: %s", DB_PATH)
\ No newline at end of file
@@ -2,25 +2,65 @@
 import sqlite3
 import os
 import shutil
-import time
 import logging
-from config import DB_PATH, BASE_DIR
+import queue
+import threading
+import atexit
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
+from config import DB_PATH, BASE_DIR, DB_POOL_SIZE, DB_MAINTENANCE_INTERVAL
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Set once DB_PATH is known to exist, so later connections skip the filesystem checks
+_db_path_ready = False
+
+def _lock_file(f) -> None:
+    """Block until this process holds an exclusive lock on the open file f."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        # LK_LOCK retries for ~10s before raising
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+def _unlock_file(f) -> None:
+    """Release a lock taken with _lock_file()."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
 
 def _ensure_db_dir_and_migrate():
     """Ensure data directory exists and handle legacy database migration with race protection."""
+    global _db_path_ready
+    if _db_path_ready:
+        return
+    
     # Create directory if it doesn't exist
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     
     # Skip migration if target already exists
     if os.path.exists(DB_PATH):
+        _db_path_ready = True
         return
     
-    # File lock to prevent migration races between API and worker
+    # Blocking file lock so concurrent starters migrate one at a time; losers wait
+    # for the winner instead of racing ahead. The lock file is left in place -
+    # unlinking it would let a late process lock a fresh inode.
     lock_file = os.path.join(os.path.dirname(DB_PATH), ".migrate.lock")
-    try:
-        # Exclusive creation - fails if another process is migrating
-        with open(lock_file, 'x') as f:
-            f.write(f"Migration started by PID {os.getpid()}")
+    with open(lock_file, 'a+b') as f:
+        _lock_file(f)
+        try:
+            # The winner may have finished while we waited
+            if os.path.exists(DB_PATH):
+                _db_path_ready = True
+                return
             
             # Migration candidates in order of preference:
             # 1. data/cost_guardian.db (newer location, preferred)
@@ -34,53 +74,203 @@ def _ensure_db_dir_and_migrate():
             
             for legacy in candidates:
                 if os.path.exists(legacy):
-                    shutil.move(legacy, DB_PATH)
+                    # Move next to the target first (may be a copy across filesystems),
+                    # then rename into place so DB_PATH never appears half-written
+                    tmp_path = DB_PATH + ".migrating"
+                    shutil.move(legacy, tmp_path)
+                    os.replace(tmp_path, DB_PATH)
                     logging.info("Migrated legacy DB from %s to %s", legacy, DB_PATH)
                     break
-                    
-    except FileExistsError:
-        # Another process is migrating, wait briefly then continue
-        logging.debug("Migration lock exists, waiting for completion...")
-        time.sleep(0.1)
-    except Exception as e:
-        logging.warning("Migration lock handling failed: %s", e)
-    finally:
-        # Clean up lock file (best effort)
-        try:
-            os.remove(lock_file)
-        except FileNotFoundError:
-            pass  # Another process cleaned it up
         except Exception as e:
-            logging.warning("Failed to remove migration lock: %s", e)
+            logging.warning("Legacy database migration failed: %s", e)
+        finally:
+            _unlock_file(f)
 
-def get_conn():
-    """Get SQLite connection with proper setup and optimizations."""
+def _connect():
+    """Open a new SQLite connection with proper setup and optimizations."""
     _ensure_db_dir_and_migrate()
     
     # Connect with timeout to reduce "database is locked" errors
     conn = sqlite3.connect(
         DB_PATH,
         timeout=30.0,  # 30 second timeout for lock conflicts
-        check_same_thread=True  # Keep default since we don't share connections across threads
+        check_same_thread=False,  # Pooled connections move between request threads
+        isolation_level=None,  # Autocommit; explicit BEGIN/COMMIT where needed
+        cached_statements=128  # Prepared statements survive across requests on pooled connections
     )
     conn.row_factory = sqlite3.Row
     
-    # Set SQLite pragmas for performance and reliability (best effort)
+    # Set per-connection SQLite pragmas for performance and reliability (best effort).
+    # journal_mode=WAL is persistent in the database file and is set once in migrate().
     try:
-        conn.execute("PRAGMA journal_mode=WAL;")       # Better concurrency
-        conn.execute("PRAGMA synchronous=NORMAL;")     # Performance/safety balance
+        conn.execute("PRAGMA synchronous=NORMAL;")     # Performance/safety balance (safe with WAL)
         conn.execute("PRAGMA foreign_keys=ON;")        # Data integrity
         conn.execute("PRAGMA busy_timeout=30000;")     # 30 second busy timeout
+        conn.execute("PRAGMA cache_size=-10000;")      # ~10MB page cache per connection
+        conn.execute("PRAGMA temp_store=MEMORY;")      # Keep sort/temp b-trees off disk
+        conn.execute("PRAGMA mmap_size=268435456;")    # Memory-map up to 256MB of the file for reads
     except Exception as e:
         # Don't crash on unsupported pragmas, just log
         logging.debug("Failed to set SQLite pragmas: %s", e)
     
     return conn
 
+# Process-wide connection pool - connections are opened lazily up to
+# DB_POOL_SIZE and reused across requests to keep SQLite's page cache hot
+_pool = queue.Queue(maxsize=DB_POOL_SIZE)
+_pool_lock = threading.Lock()
+_pool_created = 0
+_pool_pid = os.getpid()
+
+def _reset_pool_after_fork():
+    """Drop connections inherited from a parent process (e.g. Gunicorn --preload)."""
+    global _pool, _pool_created, _pool_pid
+    with _pool_lock:
+        if _pool_pid == os.getpid():
+            return
+        # Never close inherited connections - the parent still owns them
+        _pool = queue.Queue(maxsize=DB_POOL_SIZE)
+        _pool_created = 0
+        _pool_pid = os.getpid()
+
+def _acquire():
+    """Take a connection from the pool, opening a new one while below the cap."""
+    global _pool_created
+    if _pool_pid != os.getpid():
+        _reset_pool_after_fork()
+    
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        pass
+    
+    with _pool_lock:
+        can_open = _pool_created < DB_POOL_SIZE
+        if can_open:
+            _pool_created += 1
+    
+    if can_open:
+        try:
+            conn = _connect()
+            # Pooled connections are readers; writes go through write_conn()
+            conn.execute("PRAGMA query_only=1;")
+            return conn
+        except Exception:
+            with _pool_lock:
+                _pool_created -= 1
+            raise
+    
+    # Pool exhausted - wait for another thread to release a connection
+    return _pool.get()
+
+def _release(conn):
+    """Return a connection to the pool, rolling back any unfinished transaction."""
+    global _pool_created
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _pool.put_nowait(conn)
+    except Exception as e:
+        logging.warning("Discarding pooled SQLite connection: %s", e)
+        with _pool_lock:
+            _pool_created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+@contextmanager
+def get_conn():
+    """Borrow a pooled read-only SQLite connection for the duration of a with-block.
+    
+    Connections are never closed by callers; they are returned to the pool
+    on exit and closed at interpreter shutdown. Use write_conn() for writes.
+    """
+    conn = _acquire()
+    try:
+        yield conn
+    finally:
+        _release(conn)
+
+# SQLite allows one writer at a time; serializing writers in-process makes them
+# queue on a cheap lock instead of spinning in busy_timeout while readers run freely.
+# Writes use one dedicated connection per process, separate from the reader pool.
+_write_lock = threading.Lock()
+_writer = None
+_writer_pid = None
+
+@contextmanager
+def write_conn():
+    """Borrow the process's writer connection while holding the writer lock."""
+    global _writer, _writer_pid
+    with _write_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            # Never close a writer inherited across fork - the parent still owns it
+            _writer = _connect()
+            _writer_pid = os.getpid()
+        try:
+            yield _writer
+        finally:
+            if _writer.in_transaction:
+                _writer.rollback()
+
+@contextmanager
+def write_txn():
+    """Run a multi-statement write as one BEGIN IMMEDIATE transaction on the writer connection.
+    
+    The write lock is taken up front, so another process's writer makes this
+    wait in busy_timeout at BEGIN instead of failing part-way through.
+    Rolled back (by write_conn) if the block raises.
+    """
+    with write_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.execute("COMMIT")
+
+def close_pool():
+    """Close all idle pooled connections and the writer (registered with atexit)."""
+    global _pool_created, _writer
+    if _writer is not None and _writer_pid == os.getpid():
+        try:
+            _writer.close()
+        except Exception as e:
+            logging.debug("Failed to close SQLite writer connection: %s", e)
+        _writer = None
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            break
+        with _pool_lock:
+            _pool_created -= 1
+        try:
+            conn.close()
+        except Exception as e:
+            logging.debug("Failed to close pooled SQLite connection: %s", e)
+
+atexit.register(close_pool)
+
 def migrate():
-    with get_conn() as conn:
+    with write_conn() as conn:
         c = conn.cursor()
         
+        # Incremental auto-vacuum lets run_maintenance() return free pages to the OS.
+        # It only takes effect on a new (empty) database; existing files keep their mode.
+        c.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        
+        # WAL lets readers proceed while a writer commits; the mode sticks to the file
+        journal_mode = c.execute("PRAGMA journal_mode=WAL;").fetchone()[0]
+        if str(journal_mode).lower() != "wal":
+            logging.warning("SQLite journal_mode is %s (WAL unavailable)", journal_mode)
+        else:
+            logging.info("SQLite journal_mode=%s", journal_mode)
+        
+        # Apply the schema in one transaction: one commit instead of one per
+        # statement, and IMMEDIATE so workers booting together migrate in turn.
+        # write_conn() rolls back if anything below raises. A failing ALTER TABLE
+        # (column already exists) only undoes that statement, not the transaction.
+        c.execute("BEGIN IMMEDIATE")
+        
         # Create usage_log table
         c.execute("""
             CREATE TABLE IF NOT EXISTS usage_log (
@@ -147,46 +337,227 @@ def migrate():
         
         # Create indexes for performance
         c.execute("CREATE INDEX IF NOT EXISTS idx_usage_key_ts ON usage_log(api_key_id, timestamp)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_usage_ingest_ts ON usage_log(ingest_token_id, timestamp)")
+        # Covers every column /data selects, so per-token queries never touch the table.
+        # Supersedes idx_usage_ingest_ts (same leading columns) - one index to maintain on insert.
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS idx_usage_ingest_ts_cov ON usage_log(
+                ingest_token_id, timestamp, model, promptTokens, completionTokens, totalTokens, estimatedCostUSD
+            )
+        """)
+        c.execute("DROP INDEX IF EXISTS idx_usage_ingest_ts")
         c.execute("CREATE INDEX IF NOT EXISTS idx_keys_active ON api_keys(active)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_ingest_tokens_active ON ingest_tokens(active)")
         
         # Create filtering indexes for dashboard performance  
-        c.execute("CREATE INDEX IF NOT EXISTS idx_usage_ts ON usage_log(timestamp)")
+        # Covering counterpart of idx_usage_ingest_ts_cov for unscoped /data queries (rowid id
+        # comes free); supersedes the plain idx_usage_ts.
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS idx_usage_ts_cov ON usage_log(
+                timestamp, model, promptTokens, completionTokens, totalTokens, estimatedCostUSD
+            )
+        """)
+        c.execute("DROP INDEX IF EXISTS idx_usage_ts")
         c.execute("CREATE INDEX IF NOT EXISTS idx_usage_model_ts ON usage_log(model, timestamp)")
         
         # Create unique constraint for labels to prevent duplicates
         c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_api_keys_label ON api_keys(label)")
         c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_ingest_tokens_label ON ingest_tokens(label)")
         c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_ingest_tokens_token ON ingest_tokens(token)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ingest_tokens_last_seen ON ingest_tokens(last_seen_at) WHERE last_seen_at IS NOT NULL")
+        # Older releases stored last_seen_at from the client's timestamp, in any format
+        # or UTC offset. Rewrite those as server UTC ISO so the raw string comparisons
+        # in _METRICS_SQL sort chronologically; values SQLite can't parse become NULL.
+        c.execute("""
+            UPDATE ingest_tokens
+            SET last_seen_at = strftime('%Y-%m-%dT%H:%M:%S+00:00', last_seen_at)
+            WHERE last_seen_at IS NOT NULL
+              AND last_seen_at NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T[0-9][0-9]:[0-9][0-9]:[0-9][0-9]+00:00'
+        """)
+        # A future value (client clock ahead) would otherwise block every update from
+        # touch_tracking_tokens_last_seen_many() until that time; clamp it to now.
+        now_iso = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        c.execute("UPDATE ingest_tokens SET last_seen_at = ? WHERE last_seen_at > ?", (now_iso, now_iso))
         
         # Create unique idempotency index for event deduplication
         c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_usage_event ON usage_log(ingest_token_id, event_id) WHERE event_id IS NOT NULL")
         
-        conn.commit()
+        # Per-token usage count, kept current by a trigger so the token listing
+        # doesn't aggregate usage_log. Backfilled once when the column is added.
+        try:
+            c.execute("ALTER TABLE ingest_tokens ADD COLUMN usage_count INTEGER NOT NULL DEFAULT 0")
+        except Exception:
+            # Column already exists, ignore
+            pass
+        else:
+            c.execute("""
+                UPDATE ingest_tokens SET usage_count = (
+                    SELECT COUNT(*) FROM usage_log WHERE usage_log.ingest_token_id = ingest_tokens.id
+                )
+            """)
+        # Rows skipped by ON CONFLICT DO NOTHING never fire the trigger
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_usage_log_count AFTER INSERT ON usage_log
+            WHEN NEW.ingest_token_id IS NOT NULL
+            BEGIN
+                UPDATE ingest_tokens SET usage_count = usage_count + 1 WHERE id = NEW.ingest_token_id;
+            END
+        """)
+        
+        # Refresh planner statistics so new indexes are picked up right away (bounded sample)
+        c.execute("PRAGMA analysis_limit=1000;")
+        c.execute("ANALYZE;")
+        
+        c.execute("COMMIT")
+
+def run_maintenance() -> None:
+    """Reclaim free pages and refresh query planner statistics."""
+    with write_conn() as conn:
+        # No-op unless the database was created with auto_vacuum=INCREMENTAL
+        conn.execute("PRAGMA incremental_vacuum;")
+        # Sample a bounded number of rows per index so ANALYZE stays cheap on big tables
+        conn.execute("PRAGMA analysis_limit=1000;")
+        conn.execute("ANALYZE;")
+
+_maintenance_timer = None
+_maintenance_pid = None
+
+def start_maintenance(interval: float = DB_MAINTENANCE_INTERVAL) -> None:
+    """Run run_maintenance() every `interval` seconds on a daemon timer (0 disables)."""
+    global _maintenance_timer, _maintenance_pid
+    if interval <= 0:
+        return
+    # Timers don't survive fork - each Gunicorn worker schedules its own
+    if _maintenance_timer is not None and _maintenance_pid == os.getpid():
+        return
+    
+    def _tick():
+        global _maintenance_timer
+        try:
+            run_maintenance()
+            logging.info("SQLite maintenance complete (incremental_vacuum, ANALYZE)")
+        except Exception:
+            logging.exception("SQLite maintenance failed")
+        _maintenance_timer = threading.Timer(interval, _tick)
+        _maintenance_timer.daemon = True
+        _maintenance_timer.start()
+    
+    _maintenance_pid = os.getpid()
+    _maintenance_timer = threading.Timer(interval, _tick)
+    _maintenance_timer.daemon = True
+    _maintenance_timer.start()
+
+# Shared by single and batched inserts so the statement text is identical and
+# hits each pooled connection's prepared-statement cache. A repeated
+# (ingest_token_id, event_id) pair hits idx_usage_event and is skipped.
+_INSERT_USAGE_SQL = """
+    INSERT INTO usage_log (
+        timestamp, model, promptTokens, completionTokens, totalTokens, estimatedCostUSD,
+        api_key_id, ingest_token_id, source, event_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (ingest_token_id, event_id) WHERE event_id IS NOT NULL DO NOTHING
+"""
+
+def usage_params(row: dict, api_key_id: int = None, ingest_token_id: int = None, source: str = "ingest", event_id: str = None) -> tuple:
+    """Coerce a usage row into the parameter tuple for a usage_log INSERT.
+    
+    Raises:
+        ValueError, TypeError: If a numeric field cannot be coerced
+    """
+    return (
+        row.get("timestamp"),
+        row.get("model"),
+        int(row.get("promptTokens") or 0),
+        int(row.get("completionTokens") or 0),
+        int(row.get("totalTokens") or 0),
+        float(row.get("estimatedCostUSD") or 0.0),
+        api_key_id,
+        ingest_token_id,
+        source,
+        event_id,
+    )
+
+def usage_values(timestamp: str, model: str, prompt_tokens: int, completion_tokens: int, total_tokens: int, cost_usd: float,
+                 api_key_id: int = None, ingest_token_id: int = None, source: str = "ingest", event_id: str = None) -> tuple:
+    """Build the usage_log INSERT parameter tuple from values the caller already validated.
+    
+    Same order as usage_params(), without the dict lookups and coercion.
+    """
+    return (timestamp, model, prompt_tokens, completion_tokens, total_tokens, cost_usd,
+            api_key_id, ingest_token_id, source, event_id)
 
 def insert_usage(row: dict, api_key_id: int = None, ingest_token_id: int = None, source: str = "ingest", event_id: str = None):
-    with get_conn() as conn:
+    """Insert one usage row.
+    
+    Returns:
+        int: The new row id, or None if (ingest_token_id, event_id) was already stored
+    """
+    with write_conn() as conn:
         c = conn.cursor()
-        c.execute("""
-            INSERT INTO usage_log (
-                timestamp, model, promptTokens, completionTokens, totalTokens, estimatedCostUSD, 
-                api_key_id, ingest_token_id, source, event_id
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            row.get("timestamp"),
-            row.get("model"),
-            int(row.get("promptTokens") or 0),
-            int(row.get("completionTokens") or 0),
-            int(row.get("totalTokens") or 0),
-            float(row.get("estimatedCostUSD") or 0.0),
-            api_key_id,
-            ingest_token_id,
-            source,
-            event_id,
-        ))
-        conn.commit()
-        return c.lastrowid
+        c.execute(_INSERT_USAGE_SQL, usage_params(row, api_key_id, ingest_token_id, source, event_id))
+        return c.lastrowid if c.rowcount else None
+
+def insert_usage_many(rows: list) -> None:
+    """Insert many usage rows in a single transaction (one fsync per batch).
+    
+    Args:
+        rows: Parameter tuples as built by usage_params()
+    """
+    with write_txn() as conn:
+        conn.executemany(_INSERT_USAGE_SQL, rows)
+
+def insert_usage_batch(rows: list) -> list:
+    """Insert usage rows one statement at a time inside a single transaction.
+    
+    Slower than insert_usage_many() but reports what happened to each row.
+    
+    Args:
+        rows: Parameter tuples as built by usage_params()
+        
+    Returns:
+        list: The new row id for each row, or None where the
+        (ingest_token_id, event_id) pair was already stored
+    """
+    ids = []
+    with write_txn() as conn:
+        for params in rows:
+            c = conn.execute(_INSERT_USAGE_SQL, params)
+            ids.append(c.lastrowid if c.rowcount else None)
+    return ids
+
+def insert_usage_each(rows: list) -> list:
+    """Insert usage rows in one transaction, each inside its own SAVEPOINT.
+    
+    Fallback for a batch that failed as a whole: a row SQLite rejects is
+    rolled back on its own and reported, the other rows still commit.
+    
+    Args:
+        rows: Parameter tuples as built by usage_params()
+        
+    Returns:
+        list: For each row, the new row id, None where the
+        (ingest_token_id, event_id) pair was already stored, or the
+        exception that rejected the row
+    """
+    results = []
+    with write_txn() as conn:
+        for params in rows:
+            conn.execute("SAVEPOINT usage_row")
+            try:
+                c = conn.execute(_INSERT_USAGE_SQL, params)
+            except (sqlite3.Error, OverflowError) as e:
+                # Bad bindings (wrong type, int beyond 64 bits) or a constraint failure
+                conn.execute("ROLLBACK TO usage_row")
+                results.append(e)
+            else:
+                results.append(c.lastrowid if c.rowcount else None)
+            conn.execute("RELEASE usage_row")
+    return results
+
+def clear_usage() -> None:
+    """Delete all rows from usage_log and zero the per-token usage counts."""
+    with write_txn() as conn:
+        conn.execute("DELETE FROM usage_log")
+        conn.execute("UPDATE ingest_tokens SET usage_count = 0 WHERE usage_count != 0")
 
 # api_keys table deprecated - kept for backward compatibility
 
@@ -205,13 +576,12 @@ def create_tracking_token(label: str, token: str) -> dict:
     Raises:
         sqlite3.IntegrityError: If label or token already exists
     """
-    with get_conn() as conn:
+    with write_conn() as conn:
         c = conn.cursor()
         c.execute("""
             INSERT INTO ingest_tokens (label, token)
             VALUES (?, ?)
         """, (label, token))
-        conn.commit()
         token_id = c.lastrowid
         return {"id": token_id, "token": token}
 
@@ -222,22 +592,12 @@ def list_tracking_tokens() -> list:
         list: List of tracking token dictionaries
     """
     with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("""
-            SELECT 
-                t.id,
-                t.label,
-                t.token,
-                t.active,
-                t.created_at,
-                t.last_seen_at,
-                COUNT(u.id) as usage_count
-            FROM ingest_tokens t
-            LEFT JOIN usage_log u ON t.id = u.ingest_token_id
-            GROUP BY t.id, t.label, t.token, t.active, t.created_at, t.last_seen_at
-            ORDER BY t.created_at DESC
+        rows = conn.execute("""
+            SELECT id, label, token, active, created_at, last_seen_at, usage_count
+            FROM ingest_tokens
+            ORDER BY created_at DESC
         """)
-        return [dict(row) for row in c.fetchall()]
+        return [dict(row) for row in rows]
 
 def get_tracking_token_by_token(token: str) -> dict:
     """Get tracking token by token string.
@@ -249,13 +609,11 @@ def get_tracking_token_by_token(token: str) -> dict:
         dict: Token data or None if not found
     """
     with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("""
+        row = conn.execute("""
             SELECT id, label, token, active, created_at, last_seen_at
             FROM ingest_tokens
             WHERE token = ?
-        """, (token,))
-        row = c.fetchone()
+        """, (token,)).fetchone()
         return dict(row) if row else None
 
 def set_tracking_token_active(token_id: int, active: bool) -> None:
@@ -265,10 +623,9 @@ def set_tracking_token_active(token_id: int, active: bool) -> None:
         token_id: The ID of the token to update
         active: True to activate, False to deactivate
     """
-    with get_conn() as conn:
+    with write_conn() as conn:
         c = conn.cursor()
         c.execute("UPDATE ingest_tokens SET active = ? WHERE id = ?", (1 if active else 0, token_id))
-        conn.commit()
 
 def delete_tracking_token(token_id: int) -> None:
     """Delete a tracking token from the database.
@@ -276,10 +633,9 @@ def delete_tracking_token(token_id: int) -> None:
     Args:
         token_id: The ID of the token to delete
     """
-    with get_conn() as conn:
+    with write_conn() as conn:
         c = conn.cursor()
         c.execute("DELETE FROM ingest_tokens WHERE id = ?", (token_id,))
-        conn.commit()
 
 def touch_tracking_token_last_seen(token_id: int, timestamp: str) -> None:
     """Update the last seen timestamp for a tracking token.
@@ -288,44 +644,31 @@ def touch_tracking_token_last_seen(token_id: int, timestamp: str) -> None:
         token_id: The ID of the token to update
         timestamp: ISO timestamp of when the token was last used
     """
-    with get_conn() as conn:
+    with write_conn() as conn:
         c = conn.cursor()
         c.execute("UPDATE ingest_tokens SET last_seen_at = ? WHERE id = ?", (timestamp, token_id))
-        conn.commit()
 
-def check_usage_duplicate(ingest_token_id: int, event_id: str) -> bool:
-    """Check if a usage entry with the same token and event_id already exists.
+def touch_tracking_tokens_last_seen_many(touches: list) -> None:
+    """Update last_seen_at for several tracking tokens in one transaction.
     
-    Args:
-        ingest_token_id: The tracking token ID
-        event_id: The event ID to check
-        
-    Returns:
-        bool: True if duplicate exists, False otherwise
-    """
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("""
-            SELECT COUNT(*) as count 
-            FROM usage_log 
-            WHERE ingest_token_id = ? AND event_id = ?
-        """, (ingest_token_id, event_id))
-        return c.fetchone()["count"] > 0
-
-def query_usage(start: str = None, end: str = None, model: str = None, ingest_token_id: int = None, limit: int = 5000, offset: int = 0) -> list:
-    """Query usage_log with optional filters and pagination.
+    A timestamp older than the stored one is ignored, so a late batch from
+    another worker can't move last_seen_at backwards. The string comparison
+    relies on migrate() having normalized legacy values to server UTC ISO.
     
     Args:
-        start: Start timestamp (ISO-8601 UTC) for filtering (inclusive)
-        end: End timestamp (ISO-8601 UTC) for filtering (inclusive)  
-        model: Exact model name to filter by
-        ingest_token_id: Filter by specific tracking token ID
-        limit: Maximum number of rows to return (default: 5000)
-        offset: Number of rows to skip (default: 0)
-        
-    Returns:
-        list: List of usage dictionaries matching the filters
+        touches: (token_id, timestamp) pairs, timestamps as server UTC ISO strings
     """
+    with write_txn() as conn:
+        conn.executemany("""
+            UPDATE ingest_tokens SET last_seen_at = :ts
+            WHERE id = :id AND (last_seen_at IS NULL OR last_seen_at < :ts)
+        """, [{'id': token_id, 'ts': ts} for token_id, ts in touches])
+
+# Column order of rows yielded by iter_usage(as_tuples=True)
+USAGE_COLUMNS = ("id", "timestamp", "model", "promptTokens", "completionTokens", "totalTokens", "estimatedCostUSD")
+
+def _build_usage_query(start: str = None, end: str = None, model: str = None, ingest_token_id: int = None, limit: int = 5000, offset: int = 0) -> tuple:
+    """Build the filtered usage_log SELECT and its parameters."""
     sql = """
         SELECT id, timestamp, model, promptTokens, completionTokens, totalTokens, estimatedCostUSD
         FROM usage_log WHERE 1=1
@@ -347,11 +690,114 @@ def query_usage(start: str = None, end: str = None, model: str = None, ingest_to
         
     sql += " ORDER BY timestamp DESC LIMIT ? OFFSET ?"
     params.extend([int(limit), int(offset)])
+    return sql, params
+
+def iter_usage(start: str = None, end: str = None, model: str = None, ingest_token_id: int = None, limit: int = 5000, offset: int = 0, as_tuples: bool = False):
+    """Lazily yield usage_log rows matching the filters, one at a time.
+    
+    The pooled connection is held until the generator is exhausted or closed,
+    so callers streaming a response must close it (Werkzeug does on disconnect).
+    Filter arguments are the same as query_usage().
     
+    Args:
+        as_tuples: Yield raw tuples in USAGE_COLUMNS order instead of dicts
+        
+    Yields:
+        dict or tuple: One usage row
+    """
+    sql, params = _build_usage_query(start, end, model, ingest_token_id, limit, offset)
     with get_conn() as conn:
         c = conn.cursor()
-        c.execute(sql, params)
-        return [dict(row) for row in c.fetchall()]
+        if as_tuples:
+            # Skip sqlite3.Row and per-row dict construction entirely
+            c.row_factory = None
+            yield from c.execute(sql, params)
+        else:
+            for row in c.execute(sql, params):
+                yield dict(row)
+
+def query_usage(start: str = None, end: str = None, model: str = None, ingest_token_id: int = None, limit: int = 5000, offset: int = 0) -> list:
+    """Query usage_log with optional filters and pagination.
+    
+    Args:
+        start: Start timestamp (ISO-8601 UTC) for filtering (inclusive)
+        end: End timestamp (ISO-8601 UTC) for filtering (inclusive)  
+        model: Exact model name to filter by
+        ingest_token_id: Filter by specific tracking token ID
+        limit: Maximum number of rows to return (default: 5000)
+        offset: Number of rows to skip (default: 0)
+        
+    Returns:
+        list: List of usage dictionaries matching the filters
+    """
+    return list(iter_usage(start, end, model, ingest_token_id, limit, offset))
+
+def get_usage_version() -> str:
+    """Get a cheap version marker that changes whenever /data results can change.
+    
+    usage_log is append-only apart from full resets, so MAX(id) (a rowid lookup)
+    moves on every insert and on reset; the token count covers token deletes,
+    which detach usage rows from ingest_token_id filters, and MAX(ingest_tokens.id)
+    catches a delete followed by a create, which leaves the count unchanged.
+    
+    Returns:
+        str: Opaque version string
+    """
+    with get_conn() as conn:
+        row = conn.execute("""
+            SELECT (SELECT MAX(id) FROM usage_log) AS max_id,
+                   (SELECT COUNT(*) FROM ingest_tokens) AS token_count,
+                   (SELECT MAX(id) FROM ingest_tokens) AS max_token_id
+        """).fetchone()
+        return f"{row['max_id']}:{row['token_count']}:{row['max_token_id']}"
+
+def get_tracking_tokens_version() -> str:
+    """Get a cheap version marker for the GET /ingest/tokens listing.
+    
+    Covers token create/delete/toggle and last_seen_at (per-token rows - the
+    table is small) plus MAX(usage_log.id), which moves whenever an insert
+    bumps a token's usage_count, without reading the listing itself.
+    
+    Returns:
+        str: Opaque version string
+    """
+    with get_conn() as conn:
+        row = conn.execute("""
+            SELECT (SELECT MAX(id) FROM usage_log) AS max_id,
+                   (SELECT group_concat(id || ':' || active || ':' || COALESCE(last_seen_at, ''), ',')
+                    FROM ingest_tokens) AS tokens
+        """).fetchone()
+        return f"{row['max_id']}|{row['tokens']}"
+
+# One statement for all /metrics DB figures. Token activity compares raw
+# last_seen_at strings (written as server UTC ISO-8601, and legacy values are
+# normalized by migrate(), so they sort chronologically) so each bucket is a
+# range scan on idx_ingest_tokens_last_seen.
+_METRICS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM usage_log) AS usage_rows,
+        (SELECT COUNT(*) FROM ingest_tokens WHERE active=1) AS active_tokens,
+        (SELECT MAX(timestamp) FROM usage_log) AS last_usage,
+        (SELECT MAX(last_seen_at) FROM ingest_tokens WHERE last_seen_at IS NOT NULL) AS last_token_seen,
+        (SELECT COUNT(*) FROM ingest_tokens WHERE last_seen_at > ?) AS seen_1m,
+        (SELECT COUNT(*) FROM ingest_tokens WHERE last_seen_at > ?) AS seen_5m,
+        (SELECT COUNT(*) FROM ingest_tokens WHERE last_seen_at > ?) AS seen_1h
+"""
+
+def get_metrics_snapshot() -> dict:
+    """Get the database figures reported by /metrics in one query.
+    
+    Returns:
+        dict: usage_rows, active_tokens, last_usage, last_token_seen,
+        seen_1m, seen_5m, seen_1h
+    """
+    now = datetime.now(timezone.utc)
+    thresholds = tuple(
+        (now - delta).isoformat(timespec='seconds')
+        for delta in (timedelta(minutes=1), timedelta(minutes=5), timedelta(hours=1))
+    )
+    with get_conn() as conn:
+        return dict(conn.execute(_METRICS_SQL, thresholds).fetchone())
 
 def list_models() -> list:
     """Get all distinct model names from usage_log.
@@ -360,11 +806,10 @@ def list_models() -> list:
         list: Sorted list of model names
     """
     with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("""
+        rows = conn.execute("""
             SELECT DISTINCT model 
             FROM usage_log 
             WHERE model IS NOT NULL 
             ORDER BY model ASC
         """)
-        return [row[0] for row in c.fetchall()]
\ No newline at end of file
+        return [row[0] for row in rows]
\ No newline at end of file
@@ -0,0 +1,25 @@
+# gunicorn.conf.py
+# Production server settings shared by the Dockerfile, docker-compose and
+# manual runs: `gunicorn -c gunicorn.conf.py wsgi:application`.
+# Handlers are I/O-bound on SQLite, so a few processes with a thread pool each
+# (gthread) keep the per-process connection pool and caches busy.
+
+import os
+
+bind = "0.0.0.0:5001"
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Keep DB_POOL_SIZE >= threads so request threads don't wait on connections
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth
+max_requests = 2000
+max_requests_jitter = 200
+
+forwarded_allow_ips = "*"
+accesslog = "-"
+errorlog = "-"
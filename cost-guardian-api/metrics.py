@@ -2,19 +2,31 @@
 # Simple metrics collection for Cost Guardian API
 # Future: expose via /metrics endpoint for monitoring
 
+from array import array
 from collections import defaultdict, deque
 import time
 
-# Module-level counters
-rate_limit_hits = 0
-ingest_success = 0
-ingest_duplicate = 0
-ingest_bad_auth = 0
-ingest_validation_error = 0
+# Counter slots in _counters
+RATE_LIMIT_HITS = 0
+INGEST_SUCCESS = 1
+INGEST_DUPLICATE = 2
+INGEST_BAD_AUTH = 3
+INGEST_VALIDATION_ERROR = 4
+_COUNTER_NAMES = (
+    'rate_limit_hits',
+    'ingest_success',
+    'ingest_duplicate',
+    'ingest_bad_auth',
+    'ingest_validation_error',
+)
+
+# Module-level counters, updated in place so no global rebinding is needed
+_counters = array('q', [0] * len(_COUNTER_NAMES))
 
 # Latency tracking - per path with ring buffer for percentiles
-# Format: {path: {'count': int, 'sum_ms': float, 'ring': deque}}
-_latency_data = defaultdict(lambda: {'count': 0, 'sum_ms': 0.0, 'ring': deque(maxlen=200)})
+# Format: {path: {'count': int, 'sum_ms': float, 'ring': deque, 'pct': tuple|None}}
+# 'pct' caches (count, p50, p95) from the last scrape so idle paths aren't re-sorted
+_latency_data = defaultdict(lambda: {'count': 0, 'sum_ms': 0.0, 'ring': deque(maxlen=200), 'pct': None})
 
 # Status tracking - per path
 # Format: {path: {status_code: count}}
@@ -22,28 +34,23 @@ _status_data = defaultdict(lambda: defaultdict(int))
 
 def increment_rate_limit_hits():
     """Increment the rate limit hits counter."""
-    global rate_limit_hits
-    rate_limit_hits += 1
+    _counters[RATE_LIMIT_HITS] += 1
 
 def increment_ingest_success():
     """Increment the ingest success counter."""
-    global ingest_success
-    ingest_success += 1
+    _counters[INGEST_SUCCESS] += 1
 
 def increment_ingest_duplicate():
     """Increment the ingest duplicate counter."""
-    global ingest_duplicate
-    ingest_duplicate += 1
+    _counters[INGEST_DUPLICATE] += 1
 
 def increment_ingest_bad_auth():
     """Increment the ingest bad auth counter."""
-    global ingest_bad_auth
-    ingest_bad_auth += 1
+    _counters[INGEST_BAD_AUTH] += 1
 
 def increment_ingest_validation_error():
     """Increment the ingest validation error counter."""
-    global ingest_validation_error
-    ingest_validation_error += 1
+    _counters[INGEST_VALIDATION_ERROR] += 1
 
 def observe_latency(path: str, ms: float):
     """Record a latency observation for the given path.
@@ -73,13 +80,7 @@ def get_metrics() -> dict:
         dict: Current metrics values
     """
     # Basic counters
-    metrics = {
-        'rate_limit_hits': rate_limit_hits,
-        'ingest_success': ingest_success,
-        'ingest_duplicate': ingest_duplicate,
-        'ingest_bad_auth': ingest_bad_auth,
-        'ingest_validation_error': ingest_validation_error,
-    }
+    metrics = dict(zip(_COUNTER_NAMES, _counters))
     
     # Latency data nested by path
     latency_metrics = {}
@@ -92,13 +93,17 @@ def get_metrics() -> dict:
             
             # Add percentiles if we have enough data
             if len(data['ring']) >= 10:
-                sorted_values = sorted(data['ring'])
-                p50_idx = len(sorted_values) // 2
-                # Bounds-checked p95 index
-                p95_idx = max(0, min(len(sorted_values) - 1, int(len(sorted_values) * 0.95)))
+                pct = data['pct']
+                if pct is None or pct[0] != data['count']:
+                    sorted_values = sorted(data['ring'])
+                    p50_idx = len(sorted_values) // 2
+                    # Bounds-checked p95 index
+                    p95_idx = max(0, min(len(sorted_values) - 1, int(len(sorted_values) * 0.95)))
+                    pct = (data['count'], round(sorted_values[p50_idx], 2), round(sorted_values[p95_idx], 2))
+                    data['pct'] = pct
                 
-                path_metrics['p50_ms'] = round(sorted_values[p50_idx], 2)
-                path_metrics['p95_ms'] = round(sorted_values[p95_idx], 2)
+                path_metrics['p50_ms'] = pct[1]
+                path_metrics['p95_ms'] = pct[2]
             
             latency_metrics[path] = path_metrics
     
@@ -115,11 +120,7 @@ def get_metrics() -> dict:
 
 def reset_metrics():
     """Reset all metrics counters (useful for testing)."""
-    global rate_limit_hits, ingest_success, ingest_duplicate, ingest_bad_auth, ingest_validation_error
-    rate_limit_hits = 0
-    ingest_success = 0
-    ingest_duplicate = 0
-    ingest_bad_auth = 0
-    ingest_validation_error = 0
+    for i in range(len(_counters)):
+        _counters[i] = 0
     _latency_data.clear()
     _status_data.clear()
\ No newline at end of file
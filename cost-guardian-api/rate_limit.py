@@ -1,20 +1,57 @@
+import os
 import time
-import math
+import logging
+import threading
 from typing import Tuple, Dict, Any
 
+import rate_limit_redis
+
+# In-process buckets hold tokens as integers in units of 1/60000 token, so a
+# bucket refills by exactly `rpm` units per elapsed millisecond.
+TOKEN_UNITS = 60_000
+
+class _Bucket:
+    __slots__ = ('tokens', 'last_ms')
+
+    def __init__(self, tokens: int, last_ms: int):
+        self.tokens = tokens  # int, TOKEN_UNITS per token
+        self.last_ms = last_ms
+
+# Buckets are split across shards, each with its own lock, so request threads
+# only contend when their keys hash to the same shard. Power of two for masking.
+_SHARD_COUNT = 1 << ((os.cpu_count() or 1) * 4 - 1).bit_length()
+_SHARD_MASK = _SHARD_COUNT - 1
+
+# A shard this large drops buckets idle long enough to have refilled completely
+# (equivalent to a fresh bucket), so one-off keys such as client IPs don't pile up
+_SHARD_MAX_KEYS = 4096
+
+def _new_shards() -> list:
+    return [({}, threading.Lock()) for _ in range(_SHARD_COUNT)]
+
 # Module-level state for token buckets
-# Format: {key: {tokens: float, last_ms: int}}
-_buckets: Dict[str, Dict[str, Any]] = {}
+# Format: [({key: _Bucket}, Lock), ...]
+_shards: list = _new_shards()
 _rpm: int = 60
 _burst: int = 60
 _regen_rate: float = 1.0  # tokens per second
 _exempt_paths: list = []
+# Precompiled from _exempt_paths in init_limit(): exact matches and "path/" prefixes
+_exempt_exact: frozenset = frozenset()
+_exempt_prefixes: tuple = ()
 
 # Ingest-specific rate limits
 _ingest_rpm: int = 60
 _ingest_burst: int = 60
 _ingest_regen_rate: float = 1.0
 
+# Shared Redis backend (see rate_limit_redis); in-process buckets when disabled
+_redis_enabled: bool = False
+# Circuit breaker: after a Redis failure, use in-process buckets for this long
+# instead of paying the socket timeout (and a warning) on every request
+REDIS_RETRY_MS = 5000
+_redis_retry_at_ms: int = 0
+
 def init_limit(rpm: int, burst: int, exempt_paths: list = None) -> None:
     """Initialize the rate limiter with the given parameters.
     
@@ -23,13 +60,15 @@ def init_limit(rpm: int, burst: int, exempt_paths: list = None) -> None:
         burst: Maximum burst capacity (tokens)
         exempt_paths: List of paths that should bypass rate limiting
     """
-    global _rpm, _burst, _regen_rate, _exempt_paths, _buckets
+    global _rpm, _burst, _regen_rate, _exempt_paths, _exempt_exact, _exempt_prefixes, _shards
     
     _rpm = rpm
     _burst = burst
     _regen_rate = rpm / 60.0  # Convert RPM to tokens per second
     _exempt_paths = exempt_paths or []
-    _buckets = {}  # Reset buckets on init
+    _exempt_exact = frozenset(_exempt_paths)
+    _exempt_prefixes = tuple(p.rstrip('/') + '/' for p in _exempt_paths)
+    _shards = _new_shards()  # Reset buckets on init
 
 def init_ingest_limit(rpm: int, burst: int) -> None:
     """Initialize ingest-specific rate limits.
@@ -44,12 +83,26 @@ def init_ingest_limit(rpm: int, burst: int) -> None:
     _ingest_burst = burst
     _ingest_regen_rate = rpm / 60.0  # Convert RPM to tokens per second
 
+def init_redis_backend(url: str) -> bool:
+    """Share token buckets across workers through Redis.
+    
+    Args:
+        url: Redis connection URL
+        
+    Returns:
+        bool: True if the Redis backend is active, False if falling back to in-process buckets
+    """
+    global _redis_enabled, _redis_retry_at_ms
+    _redis_enabled = rate_limit_redis.init_redis(url)
+    _redis_retry_at_ms = 0
+    return _redis_enabled
+
 def check_rate_limit(key: str, now_ms: int = None) -> Tuple[bool, int, float]:
     """Check if a request should be rate limited using token bucket algorithm.
     
     Args:
         key: The identifier to rate limit (API key, IP address, etc.)
-        now_ms: Current time in milliseconds (uses time.monotonic() if None)
+        now_ms: Current time in milliseconds (uses time.monotonic_ns() if None)
         
     Returns:
         Tuple of (allowed: bool, retry_after_seconds: int, remaining_tokens: float)
@@ -57,47 +110,60 @@ def check_rate_limit(key: str, now_ms: int = None) -> Tuple[bool, int, float]:
         - retry_after_seconds: Number of seconds to wait before retrying (0 if allowed)
         - remaining_tokens: Current number of tokens remaining in bucket
     """
+    global _redis_retry_at_ms
     if now_ms is None:
-        now_ms = int(time.monotonic() * 1000)
+        now_ms = time.monotonic_ns() // 1_000_000
     
     # Determine which rate limits to use based on key
     if key.startswith("ingest:"):
+        rpm = _ingest_rpm
         burst = _ingest_burst
         regen_rate = _ingest_regen_rate
     else:
+        rpm = _rpm
         burst = _burst
         regen_rate = _regen_rate
     
-    # Get or create bucket for this key
-    if key not in _buckets:
-        _buckets[key] = {
-            'tokens': float(burst),  # Start with full bucket
-            'last_ms': now_ms
-        }
-    
-    bucket = _buckets[key]
+    if _redis_enabled and now_ms >= _redis_retry_at_ms:
+        try:
+            return rate_limit_redis.check_rate_limit_redis(key, burst, regen_rate)
+        except Exception as e:
+            # Fail over to this worker's own buckets rather than rejecting or failing the request
+            _redis_retry_at_ms = now_ms + REDIS_RETRY_MS
+            logging.warning("Redis rate limit check failed, using in-process buckets for %dms: %s",
+                            REDIS_RETRY_MS, e)
     
-    # Calculate time elapsed since last check
-    elapsed_ms = now_ms - bucket['last_ms']
-    elapsed_sec = elapsed_ms / 1000.0
-    
-    # Refill tokens based on elapsed time
-    tokens_to_add = elapsed_sec * regen_rate
-    bucket['tokens'] = min(burst, bucket['tokens'] + tokens_to_add)
-    bucket['last_ms'] = now_ms
-    
-    # Check if we have enough tokens for this request
-    if bucket['tokens'] >= 1.0:
-        # Allow request and consume one token
-        bucket['tokens'] -= 1.0
-        return True, 0, bucket['tokens']
-    else:
-        # Rate limited - calculate when enough tokens will be available
-        tokens_needed = 1.0 - bucket['tokens']
-        deficit_seconds = tokens_needed / regen_rate
-        retry_after = max(1, math.ceil(deficit_seconds))
+    capacity = burst * TOKEN_UNITS
+    buckets, lock = _shards[hash(key) & _SHARD_MASK]
+    with lock:
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= _SHARD_MAX_KEYS:
+                _evict_idle(buckets, now_ms)
+            bucket = buckets[key] = _Bucket(capacity, now_ms)  # Start with full bucket
+        elif now_ms > bucket.last_ms:
+            # Refill: rpm units per elapsed millisecond, capped at capacity.
+            # now_ms is read before the lock, so a racing thread may be behind.
+            bucket.tokens = min(capacity, bucket.tokens + (now_ms - bucket.last_ms) * rpm)
+            bucket.last_ms = now_ms
         
-        return False, retry_after, bucket['tokens']
+        tokens = bucket.tokens
+        if tokens >= TOKEN_UNITS:
+            # Allow request and consume one token
+            tokens = bucket.tokens = tokens - TOKEN_UNITS
+            return True, 0, tokens / TOKEN_UNITS
+    
+    # Rate limited - whole seconds until one token has refilled (ceil division)
+    retry_after = max(1, -((tokens - TOKEN_UNITS) // (rpm * 1000)))
+    return False, retry_after, tokens / TOKEN_UNITS
+
+def _evict_idle(buckets: dict, now_ms: int) -> None:
+    """Drop buckets that have been idle long enough to be full again (caller holds the shard lock)."""
+    # Slowest refill across the admin and ingest limits, in ms from empty to full
+    full_after_ms = max(-(-_burst * 60_000 // _rpm), -(-_ingest_burst * 60_000 // _ingest_rpm))
+    cutoff = now_ms - full_after_ms
+    for key in [k for k, b in buckets.items() if b.last_ms <= cutoff]:
+        del buckets[key]
 
 def is_exempt_path(path: str, method: str = None) -> bool:
     """Check if a path should be exempt from rate limiting.
@@ -114,7 +180,7 @@ def is_exempt_path(path: str, method: str = None) -> bool:
         return True
     
     # Check configured exempt paths (exact match or prefix match)
-    return any(path == p or path.startswith(p.rstrip('/') + '/') for p in _exempt_paths)
+    return path in _exempt_exact or path.startswith(_exempt_prefixes)
 
 def get_config() -> dict:
     """Get current rate limiting configuration.
@@ -123,6 +189,7 @@ def get_config() -> dict:
         dict: Current configuration including rpm, burst, and exempt paths
     """
     return {
+        'backend': 'redis' if _redis_enabled else 'memory',
         'rpm': _rpm,
         'burst': _burst,
         'regen_rate': _regen_rate,
@@ -140,4 +207,9 @@ def get_bucket_stats() -> Dict[str, Dict[str, Any]]:
     Returns:
         dict: Copy of current bucket states
     """
-    return {key: bucket.copy() for key, bucket in _buckets.items()}
\ No newline at end of file
+    stats = {}
+    for buckets, lock in _shards:
+        with lock:
+            for key, bucket in buckets.items():
+                stats[key] = {'tokens': bucket.tokens / TOKEN_UNITS, 'last_ms': bucket.last_ms}
+    return stats
\ No newline at end of file
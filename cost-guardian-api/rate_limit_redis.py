@@ -0,0 +1,123 @@
+# rate_limit_redis.py
+# Shared token-bucket rate limiter backed by Redis. Each bucket is a Redis hash
+# updated atomically by a Lua script, so every Gunicorn worker (and every host)
+# draws from the same bucket instead of each getting its own RPM allowance.
+
+import time
+import hashlib
+import logging
+import threading
+from typing import Tuple
+
+# KEYS[1] = bucket key; ARGV = regen_rate (tokens/sec), burst
+# Returns {allowed (0/1), remaining tokens (string), retry_after seconds}
+# Uses the Redis server clock so workers with skewed clocks agree on refill.
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = burst
+    ts = now
+end
+
+tokens = math.min(burst, tokens + math.max(0, now - ts) / 1000 * rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = math.max(1, math.ceil((1 - tokens) / rate))
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+-- Idle buckets expire once they would have refilled completely
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(tokens), retry_after}
+"""
+
+# Buckets are stored as KEY_PREFIX + a hash of the limiter key, so API keys
+# and tracking tokens never reach Redis in plaintext
+KEY_PREFIX = "rl:"
+
+_client = None
+_script = None
+
+# Keys denied recently, mapped to the monotonic time their bucket next has a
+# token. Requests from a key in a blocked storm are rejected locally without
+# a Redis round trip until then.
+_denied: dict = {}
+_denied_lock = threading.Lock()
+_DENIED_MAX_KEYS = 10000
+
+def init_redis(url: str) -> bool:
+    """Connect to Redis and register the token-bucket script.
+
+    Args:
+        url: Redis connection URL (e.g. redis://localhost:6379/0)
+
+    Returns:
+        bool: True if Redis is reachable and the backend is ready
+    """
+    global _client, _script
+    try:
+        import redis
+    except ImportError:
+        logging.error("REDIS_URL is set but the 'redis' package is not installed")
+        return False
+
+    try:
+        client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        client.ping()
+    except Exception as e:
+        logging.error("Redis rate limiter unavailable (%s)", e)
+        return False
+
+    _client = client
+    _script = client.register_script(TOKEN_BUCKET_LUA)
+    with _denied_lock:
+        _denied.clear()
+    return True
+
+def check_rate_limit_redis(key: str, burst: int, regen_rate: float) -> Tuple[bool, int, float]:
+    """Take one token from the shared bucket for `key`.
+
+    Args:
+        key: The identifier to rate limit
+        burst: Maximum burst capacity (tokens)
+        regen_rate: Tokens regenerated per second
+
+    Returns:
+        Tuple of (allowed: bool, retry_after_seconds: int, remaining_tokens: float)
+
+    Raises:
+        redis.RedisError: If the script cannot be executed
+    """
+    key = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    now = time.monotonic()
+    blocked_until = _denied.get(key)
+    if blocked_until is not None:
+        if now < blocked_until:
+            return False, max(1, int(blocked_until - now + 0.999)), 0.0
+        with _denied_lock:
+            _denied.pop(key, None)
+
+    allowed, remaining, retry_after = _script(keys=[KEY_PREFIX + key], args=[regen_rate, burst])
+    remaining = float(remaining)
+
+    if not allowed:
+        with _denied_lock:
+            if len(_denied) >= _DENIED_MAX_KEYS:
+                _denied.clear()
+            # Exact time until the bucket holds one token again
+            _denied[key] = now + (1.0 - remaining) / regen_rate
+        return False, int(retry_after), remaining
+
+    return True, 0, remaining
@@ -0,0 +1,282 @@
+# writer.py
+# Background batch writer for usage rows. Rows are queued by request threads
+# and committed in batches by a single daemon thread, turning N commits into
+# one per batch. Legacy /log queues rows and returns immediately; /ingest
+# waits for its row (group commit) because it reports the id or a duplicate.
+# Tracking-token last_seen_at updates from /ingest are coalesced the same way:
+# only the latest timestamp per token is kept and flushed periodically.
+
+import queue
+import threading
+import time
+import logging
+import atexit
+import os
+
+from db import insert_usage_many, insert_usage_batch, insert_usage_each, touch_tracking_tokens_last_seen_many
+
+# Flush when this many rows are pending or the oldest has waited this long
+BATCH_MAX_ROWS = 500
+BATCH_MAX_WAIT_SECS = 0.05
+
+# Rows allowed to wait for the writer; beyond this callers are told to back off
+QUEUE_MAX_ROWS = 10000
+
+# How long insert_usage_sync waits by default: longer than the writer
+# connection's 30s busy_timeout plus a full batch, so a row is only reported
+# as timed out when the writer is genuinely stuck
+SYNC_WAIT_SECS = 45.0
+
+# How often coalesced last_seen_at updates are written
+TOUCH_FLUSH_SECS = 0.5
+
+_STOP = object()
+
+# Called in the writer thread after usage rows are committed (e.g. to drop /data ETags)
+_commit_hooks = []
+
+class _SyncInsert:
+    """A queued row whose caller is waiting for the outcome."""
+    __slots__ = ('params', 'done', 'result', 'error')
+    
+    def __init__(self, params: tuple):
+        self.params = params
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+# Unbounded at the Queue level so a batch is never half-queued and the stop
+# sentinel can always be added; QUEUE_MAX_ROWS is enforced in enqueue_usage_many()
+_queue = queue.Queue()
+_thread = None
+_thread_pid = None
+_lock = threading.Lock()
+
+# Pending last_seen_at updates: {token_id: timestamp}, latest wins
+_touches = {}
+_touch_lock = threading.Lock()
+_touch_thread = None
+_touch_thread_pid = None
+_touch_stop = threading.Event()
+
+def start_writer() -> None:
+    """Start the writer thread for this process if it isn't running yet."""
+    global _thread, _thread_pid
+    with _lock:
+        # Threads don't survive fork - restart in each Gunicorn worker
+        if _thread is not None and _thread_pid == os.getpid() and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=_writer_loop, name="usage-writer", daemon=True)
+        _thread_pid = os.getpid()
+        _thread.start()
+
+def enqueue_usage(params: tuple) -> None:
+    """Queue a usage_log parameter tuple (see db.usage_params) for batched insert.
+    
+    Raises:
+        queue.Full: If the writer is QUEUE_MAX_ROWS rows behind
+    """
+    enqueue_usage_many([params])
+
+def enqueue_usage_many(rows: list) -> None:
+    """Queue several usage_log parameter tuples; they land in the same batch when they fit.
+    
+    Either all rows are queued or none are.
+    
+    Raises:
+        queue.Full: If the rows don't fit in the remaining queue capacity
+    """
+    if _thread is None or _thread_pid != os.getpid():
+        start_writer()
+    # Soft limit - concurrent requests may overshoot by at most their own batch sizes
+    if _queue.qsize() + len(rows) > QUEUE_MAX_ROWS:
+        raise queue.Full
+    for params in rows:
+        _queue.put(params)
+
+def insert_usage_sync(params: tuple, timeout: float = SYNC_WAIT_SECS):
+    """Insert a usage row through the writer and wait for it to be committed.
+    
+    Concurrent callers share one transaction, but a lone caller isn't held
+    back for BATCH_MAX_WAIT_SECS.
+    
+    Args:
+        params: usage_log parameter tuple (see db.usage_params)
+        timeout: Seconds to wait for the writer
+        
+    Returns:
+        int: The new row id, or None if (ingest_token_id, event_id) was already stored
+        
+    Raises:
+        TimeoutError: If the writer doesn't commit the row in time. The row
+            stays queued and may still be committed afterwards.
+    """
+    if _thread is None or _thread_pid != os.getpid():
+        start_writer()
+    item = _SyncInsert(params)
+    _queue.put(item)
+    if not item.done.wait(timeout):
+        raise TimeoutError("Usage writer did not commit the row in time")
+    if item.error is not None:
+        raise item.error
+    return item.result
+
+def add_commit_hook(fn) -> None:
+    """Register fn() to run in the writer thread after each batch of usage rows commits.
+    
+    Hooks run before synchronous callers are released, so an /ingest response
+    is never sent ahead of them.
+    """
+    _commit_hooks.append(fn)
+
+def _run_commit_hooks() -> None:
+    for fn in _commit_hooks:
+        try:
+            fn()
+        except Exception:
+            logging.exception("Usage writer commit hook failed")
+
+def queue_depth() -> int:
+    """Number of rows waiting for the writer thread."""
+    return _queue.qsize()
+
+def _drain():
+    """Block for the first row, then collect more until the batch is full or times out.
+    
+    Returns:
+        tuple: (batch: list, stop: bool)
+    """
+    item = _queue.get()
+    if item is _STOP:
+        return [], True
+    
+    batch = [item]
+    # Someone is waiting on a synchronous insert: take only what's already queued
+    waiting = type(item) is _SyncInsert
+    deadline = time.monotonic() + BATCH_MAX_WAIT_SECS
+    while len(batch) < BATCH_MAX_ROWS:
+        try:
+            if waiting:
+                item = _queue.get_nowait()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                item = _queue.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+        waiting = waiting or type(item) is _SyncInsert
+    return batch, False
+
+def _write_batch(batch: list) -> None:
+    waiters = [item for item in batch if type(item) is _SyncInsert]
+    if not waiters:
+        try:
+            insert_usage_many(batch)
+        except Exception:
+            # Rows from different requests share this batch; don't let one bad row drop the rest
+            logging.warning("Usage writer batch of %d rows failed, retrying row by row", len(batch), exc_info=True)
+            _write_rows_each(batch)
+        _run_commit_hooks()
+        return
+    
+    rows = [item.params if type(item) is _SyncInsert else item for item in batch]
+    try:
+        try:
+            results = insert_usage_batch(rows)
+        except Exception:
+            # Only the caller whose row SQLite rejects should see an error
+            logging.warning("Usage writer batch of %d rows failed, retrying row by row", len(batch), exc_info=True)
+            results = _write_rows_each(rows)
+        for item, result in zip(batch, results):
+            if type(item) is _SyncInsert:
+                if isinstance(result, Exception):
+                    item.error = result
+                else:
+                    item.result = result
+        _run_commit_hooks()
+    finally:
+        for item in waiters:
+            item.done.set()
+
+def _write_rows_each(rows: list) -> list:
+    """Insert rows one SAVEPOINT at a time, logging the ones SQLite rejects.
+    
+    Returns:
+        list: Per-row results from db.insert_usage_each(); every entry is the
+        exception if the fallback transaction itself failed
+    """
+    try:
+        results = insert_usage_each(rows)
+    except Exception as e:
+        logging.exception("Usage writer failed to insert %d rows", len(rows))
+        return [e] * len(rows)
+    for params, result in zip(rows, results):
+        if isinstance(result, Exception):
+            logging.error("Usage writer dropped row %r: %s", params, result)
+    return results
+
+def _writer_loop():
+    while True:
+        batch, stop = _drain()
+        if batch:
+            _write_batch(batch)
+        if stop:
+            return
+
+def touch_last_seen(token_id: int, timestamp: str) -> None:
+    """Record that a tracking token was seen; written within TOUCH_FLUSH_SECS.
+    
+    Args:
+        token_id: The tracking token ID
+        timestamp: Server UTC ISO timestamp of the request
+    """
+    if _touch_thread is None or _touch_thread_pid != os.getpid():
+        _start_toucher()
+    with _touch_lock:
+        _touches[token_id] = timestamp
+
+def _start_toucher() -> None:
+    global _touch_thread, _touch_thread_pid
+    with _lock:
+        # Threads don't survive fork - restart in each Gunicorn worker
+        if _touch_thread is not None and _touch_thread_pid == os.getpid() and _touch_thread.is_alive():
+            return
+        _touch_stop.clear()
+        _touch_thread = threading.Thread(target=_toucher_loop, name="token-touch-writer", daemon=True)
+        _touch_thread_pid = os.getpid()
+        _touch_thread.start()
+
+def _flush_touches() -> None:
+    global _touches
+    with _touch_lock:
+        if not _touches:
+            return
+        pending, _touches = _touches, {}
+    try:
+        touch_tracking_tokens_last_seen_many(list(pending.items()))
+    except Exception:
+        logging.exception("Usage writer failed to update last_seen_at for %d tokens", len(pending))
+
+def _toucher_loop():
+    while not _touch_stop.wait(TOUCH_FLUSH_SECS):
+        _flush_touches()
+    _flush_touches()
+
+def stop_writer(timeout: float = 5.0) -> None:
+    """Flush queued rows and pending touches, then stop both threads (registered with atexit)."""
+    touch_thread = _touch_thread
+    if touch_thread is not None and _touch_thread_pid == os.getpid() and touch_thread.is_alive():
+        _touch_stop.set()
+        touch_thread.join(timeout)
+    
+    thread = _thread
+    if thread is None or _thread_pid != os.getpid() or not thread.is_alive():
+        return
+    _queue.put(_STOP)
+    thread.join(timeout)
+
+atexit.register(stop_writer)
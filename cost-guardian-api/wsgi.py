@@ -0,0 +1,7 @@
+# wsgi.py
+# WSGI entrypoint for production servers, e.g.:
+#   gunicorn -k gthread -w 2 --threads 8 -b 0.0.0.0:5001 wsgi:application
+
+from app import app
+
+application = app